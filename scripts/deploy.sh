@@ -101,6 +101,12 @@ if ! command -v aws &> /dev/null; then
     exit 1
 fi
 
+# python3・pipの存在確認（Lambdaの依存ライブラリのパッケージングとパラメータの生成に使用）
+if ! command -v python3 &> /dev/null || ! command -v pip &> /dev/null; then
+    echo -e "${RED}Error: python3 / pip がインストールされていません${NC}"
+    exit 1
+fi
+
 # プロファイルの確認
 echo -e "${GREEN}AWS プロファイルを確認中...${NC}"
 if ! aws sts get-caller-identity --profile "$PROFILE" &> /dev/null; then
@@ -163,11 +169,45 @@ fi
 if [ ! -f "$PARAMETERS_FILE" ]; then
     echo -e "${YELLOW}警告: パラメータファイルが見つかりません: $PARAMETERS_FILE${NC}"
     echo "デフォルトパラメータを使用します"
-    PARAMETERS_OPTION=""
-else
-    PARAMETERS_OPTION="--parameter-overrides file://${PARAMETERS_FILE}"
 fi
 
+# helpdesk_processorのコードと設定のリビジョン
+# 変更があった場合のみCloudFormationが新しいバージョンを発行し、エイリアス（live）を更新する
+CODE_REVISION=$(python3 - "$PARAMETERS_FILE" <<'PYTHON'
+import glob
+import hashlib
+import os
+import sys
+
+paths = sorted(glob.glob('src/lambda/*.py')) + ['requirements.txt', 'infrastructure/templates/lambda.yaml', sys.argv[1]]
+digest = hashlib.sha256()
+for path in paths:
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+print(digest.hexdigest()[:16])
+PYTHON
+)
+echo "Lambdaコードのリビジョン: ${CODE_REVISION}"
+
+# パラメータファイルにリビジョンを追加したパラメータを作成
+DEPLOY_PARAMETERS_FILE=$(mktemp)
+trap 'rm -f "$DEPLOY_PARAMETERS_FILE"' EXIT
+python3 - "$PARAMETERS_FILE" "$CODE_REVISION" > "$DEPLOY_PARAMETERS_FILE" <<'PYTHON'
+import json
+import os
+import sys
+
+path, revision = sys.argv[1:]
+parameters = []
+if os.path.exists(path):
+    with open(path, encoding='utf-8') as f:
+        parameters = [p for p in json.load(f) if p['ParameterKey'] != 'LambdaCodeRevision']
+parameters.append({'ParameterKey': 'LambdaCodeRevision', 'ParameterValue': revision})
+json.dump(parameters, sys.stdout, indent=2)
+PYTHON
+PARAMETERS_OPTION="--parameter-overrides file://${DEPLOY_PARAMETERS_FILE}"
+
 # S3バケットの作成（存在しない場合）
 echo -e "${GREEN}アーティファクト用S3バケットを確認中...${NC}"
 if aws s3 ls "s3://${S3_BUCKET}" --profile "$PROFILE" --region "$REGION" 2>&1 | grep -q 'NoSuchBucket'; then
@@ -213,19 +253,32 @@ if [ -d "src/lambda" ]; then
     # 全てのPythonファイルをコピー
     cp -r src/lambda/*.py "$LAMBDA_DIR/"
     
+    # 依存ライブラリ（numpy等）をLambda実行環境（python3.11・x86_64）向けのバイナリでインストール
+    # boto3はLambdaランタイムに含まれるため同梱しない
+    grep -v -E '^(boto3|botocore)' requirements.txt > "$TEMP_DIR/requirements-lambda.txt"
+    pip install \
+        -r "$TEMP_DIR/requirements-lambda.txt" \
+        -t "$LAMBDA_DIR" \
+        --platform manylinux2014_x86_64 \
+        --implementation cp \
+        --python-version 3.11 \
+        --only-binary=:all: \
+        --quiet
+    
     # helpdesk_processor用のzipを作成（メイン関数）
-    (cd "$LAMBDA_DIR" && zip -r helpdesk_processor.zip *.py)
+    (cd "$LAMBDA_DIR" && zip -qr "$TEMP_DIR/helpdesk_processor.zip" . -x '__pycache__/*' '*/__pycache__/*')
     
-    # S3にアップロード
-    aws s3 cp "$LAMBDA_DIR/helpdesk_processor.zip" "s3://${S3_BUCKET}/lambda/helpdesk_processor.zip" \
+    # S3にアップロード（リビジョンごとのキーとし、コードの変更をCloudFormationに反映する）
+    aws s3 cp "$TEMP_DIR/helpdesk_processor.zip" "s3://${S3_BUCKET}/lambda/helpdesk_processor-${CODE_REVISION}.zip" \
         --profile "$PROFILE" \
         --region "$REGION"
     
     # 他のLambda関数も個別にパッケージング（必要に応じて）
-    for lambda_file in quality_metrics kb_update; do
+    for lambda_file in quality_metrics kb_update concurrency_autoscaler; do
         if [ -f "$LAMBDA_DIR/${lambda_file}.py" ]; then
-            (cd "$LAMBDA_DIR" && zip -r "${lambda_file}.zip" "${lambda_file}.py" error_handler.py)
-            aws s3 cp "$LAMBDA_DIR/${lambda_file}.zip" "s3://${S3_BUCKET}/lambda/${lambda_file}.zip" \
+            # 共通モジュール（ingestion_tracker等）と依存ライブラリを含めるため全ファイルをパッケージング
+            cp "$TEMP_DIR/helpdesk_processor.zip" "$TEMP_DIR/${lambda_file}.zip"
+            aws s3 cp "$TEMP_DIR/${lambda_file}.zip" "s3://${S3_BUCKET}/lambda/${lambda_file}.zip" \
                 --profile "$PROFILE" \
                 --region "$REGION"
         fi
@@ -274,6 +327,9 @@ aws cloudformation deploy \
 if [ $? -eq 0 ]; then
     echo -e "${GREEN}=== デプロイが正常に完了しました ===${NC}"
     
+    # エイリアス（live）はlambda.yamlのHelpdeskProcessorVersionが発行したバージョンを向く
+    # Provisioned Concurrencyはエイリアスの新しいバージョンに引き継がれる
+    
     # スタックの出力を表示
     echo -e "${GREEN}スタック出力:${NC}"
     aws cloudformation describe-stacks \
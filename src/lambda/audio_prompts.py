@@ -0,0 +1,256 @@
+import hashlib
+import json
+import logging
+import struct
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+from botocore.exceptions import ClientError
+
+from ingestion_tracker import KNOWLEDGE_VERSION_KEY
+
+logger = logging.getLogger()
+
+# 事前合成した音声プロンプトの保存先
+# 注：qa-data/ はKnowledge Baseのデータソース対象のため、別プレフィックスに配置する
+AUDIO_PREFIX = 'knowledge-artifacts/audio'
+AUDIO_MANIFEST_KEY = f'{AUDIO_PREFIX}/manifest.json'
+
+# 不要になった音声を削除するまでの、ナレッジバージョン公開後の猶予（秒）
+# 実行時はKNOWLEDGE_VERSION_CHECK_INTERVAL秒ごとにマーカーを確認してマニフェストを読み直すため、それより長くする
+RETIRE_GRACE_SECONDS = 300
+
+# Amazon Connectのプロンプト形式（8kHz・モノラル・μ-law）
+SAMPLE_RATE = 8000
+
+def audio_hash(text: str, voice_id: str, engine: str) -> str:
+    """回答テキストと音声設定から音声オブジェクトのハッシュを算出"""
+    return hashlib.sha256(f"{voice_id}|{engine}|{text}".encode('utf-8')).hexdigest()
+
+def linear_to_ulaw(sample: int) -> int:
+    """16bitリニアPCMの1サンプルをG.711 μ-lawに変換"""
+    bias, clip = 0x84, 32635
+    sign = 0x80 if sample < 0 else 0
+    if sample < 0:
+        sample = -sample
+    sample = min(sample, clip) + bias
+
+    exponent = 7
+    mask = 0x4000
+    while exponent > 0 and not sample & mask:
+        exponent -= 1
+        mask >>= 1
+
+    mantissa = (sample >> (exponent + 3)) & 0x0F
+    return ~(sign | (exponent << 4) | mantissa) & 0xFF
+
+def encode_ulaw_wav(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """16bitリニアPCM（リトルエンディアン・モノラル）をμ-lawのWAVに変換"""
+    samples = struct.unpack(f'<{len(pcm) // 2}h', pcm[:len(pcm) // 2 * 2])
+    data = bytes(linear_to_ulaw(s) for s in samples)
+
+    fmt = struct.pack('<HHIIHHH', 7, 1, sample_rate, sample_rate, 1, 8, 0)
+    fact = struct.pack('<I', len(data))
+    return b''.join([
+        b'RIFF', struct.pack('<I', 4 + (8 + len(fmt)) + (8 + len(fact)) + (8 + len(data))), b'WAVE',
+        b'fmt ', struct.pack('<I', len(fmt)), fmt,
+        b'fact', struct.pack('<I', len(fact)), fact,
+        b'data', struct.pack('<I', len(data)), data
+    ])
+
+class PollySynthesizer:
+    """Amazon Pollyによる音声合成"""
+    def __init__(self, polly_client, voice_id: str = 'Takumi', engine: str = 'neural'):
+        self.polly = polly_client
+        self.voice_id = voice_id
+        self.engine = engine
+
+    def synthesize(self, text: str) -> bytes:
+        """テキストを16bitリニアPCM（8kHz）に合成"""
+        response = self.polly.synthesize_speech(
+            Text=text,
+            VoiceId=self.voice_id,
+            Engine=self.engine,
+            LanguageCode='ja-JP',
+            OutputFormat='pcm',
+            SampleRate=str(SAMPLE_RATE)
+        )
+        return response['AudioStream'].read()
+
+class LocalSynthesizer:
+    """
+    無音のPCMを返す音声合成の代替
+    Pollyを使用しないローカル実行・検証用
+    """
+    def __init__(self, voice_id: str = 'local', engine: str = 'local', seconds_per_char: float = 0.1):
+        self.voice_id = voice_id
+        self.engine = engine
+        self.seconds_per_char = seconds_per_char
+
+    def synthesize(self, text: str) -> bytes:
+        return b'\x00\x00' * int(len(text) * self.seconds_per_char * SAMPLE_RATE)
+
+def select_popular_answers(usage: Dict[str, float], top_n: int, min_count: float = 1) -> List[str]:
+    """
+    利用回数の多い回答を事前合成の対象として選択
+
+    Args:
+        usage: Q&A IDごとの利用回数
+        top_n: 選択する最大件数
+        min_count: 対象とする最小利用回数
+
+    Returns:
+        Q&A IDのリスト（利用回数の降順）
+    """
+    ranked = sorted(
+        (item for item in usage.items() if item[1] >= min_count),
+        key=lambda item: item[1],
+        reverse=True
+    )
+    return [answer_id for answer_id, _ in ranked[:top_n]]
+
+class AudioPromptCache:
+    """
+    回答音声の事前合成とS3上のキャッシュ管理
+    音声オブジェクトは内容ハッシュをキーとし、回答が変わらない限り再合成しない
+    不要になった音声は、実行中のプロセッサが古いマニフェストを参照している間は削除せず
+    マニフェストのretiredに記録し、その後ナレッジバージョンが公開されてから猶予を過ぎた後の実行で削除する
+    """
+    def __init__(self, s3_client, bucket: str, synthesizer, retire_grace: float = RETIRE_GRACE_SECONDS,
+                 now: Callable[[], datetime] = datetime.utcnow):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.synthesizer = synthesizer
+        self.retire_grace = retire_grace
+        self.now = now
+
+    def load_manifest(self) -> Dict[str, Any]:
+        """マニフェストを読み込む（未作成の場合は空のマニフェスト）"""
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=AUDIO_MANIFEST_KEY)
+            return json.loads(response['Body'].read().decode('utf-8'))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return {'prompts': {}}
+            raise
+
+    def load_published_at(self) -> Optional[datetime]:
+        """最後にナレッジバージョンを公開した時刻（未公開の場合はNone）"""
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=KNOWLEDGE_VERSION_KEY)
+            marker = json.loads(response['Body'].read().decode('utf-8'))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return datetime.fromisoformat(marker['publishedAt'])
+
+    def purge_retired(self, retired: Dict[str, str], now: datetime) -> Dict[str, str]:
+        """
+        参照されなくなった音声を削除
+
+        Args:
+            retired: 不要になった音声のキーと、不要になった時刻
+            now: 現在時刻
+
+        Returns:
+            削除できなかった（まだ削除できない）音声
+        """
+        if not retired:
+            return {}
+        published_at = self.load_published_at()
+        if published_at is None or (now - published_at).total_seconds() < self.retire_grace:
+            # 公開直後は古いマニフェストを保持しているプロセッサが残っている可能性がある
+            return dict(retired)
+
+        remaining = {}
+        for key, retired_at in retired.items():
+            if datetime.fromisoformat(retired_at) >= published_at:
+                # 不要になった後にバージョンが公開されていない（古いマニフェストが使われ続けている）
+                remaining[key] = retired_at
+                continue
+            try:
+                self.s3.delete_object(Bucket=self.bucket, Key=key)
+            except ClientError as e:
+                logger.warning(f"Failed to delete retired audio prompt {key}: {e}")
+                remaining[key] = retired_at
+        return remaining
+
+    def prerender(self, qa_data: List[Dict[str, Any]], answer_ids: List[str]) -> Dict[str, Any]:
+        """
+        選択された回答の音声を合成してS3に保存
+
+        Args:
+            qa_data: Q&Aデータ
+            answer_ids: 事前合成するQ&A ID
+
+        Returns:
+            更新後のマニフェスト
+        """
+        previous_manifest = self.load_manifest()
+        previous = previous_manifest['prompts']
+        retired = dict(previous_manifest.get('retired', {}))
+        now = self.now()
+        qa_by_id = {qa['id']: qa for qa in qa_data}
+        voice_id, engine = self.synthesizer.voice_id, self.synthesizer.engine
+
+        prompts = {}
+        synthesized = 0
+        for answer_id in answer_ids:
+            qa = qa_by_id.get(answer_id)
+            if qa is None:
+                continue
+
+            content_hash = audio_hash(qa['answer'], voice_id, engine)
+            key = f'{AUDIO_PREFIX}/{content_hash}.wav'
+
+            if previous.get(answer_id, {}).get('hash') != content_hash:
+                audio = encode_ulaw_wav(self.synthesizer.synthesize(qa['answer']))
+                self.s3.put_object(Bucket=self.bucket, Key=key, Body=audio, ContentType='audio/wav')
+                synthesized += 1
+
+            prompts[answer_id] = {'hash': content_hash, 'key': key}
+
+        # 選択から外れた、または回答が更新された音声は、古いマニフェストから参照されている間は残す
+        current_keys = {p['key'] for p in prompts.values()}
+        for stale_key in {p['key'] for p in previous.values()} - current_keys:
+            retired.setdefault(stale_key, now.isoformat())
+        for key in current_keys:
+            retired.pop(key, None)
+        retired = self.purge_retired(retired, now)
+
+        manifest = {
+            'generatedAt': now.isoformat(),
+            'voiceId': voice_id,
+            'engine': engine,
+            'prompts': prompts,
+            'retired': retired
+        }
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=AUDIO_MANIFEST_KEY,
+            Body=json.dumps(manifest),
+            ContentType='application/json'
+        )
+
+        logger.info(f"Audio prompts prerendered: {len(prompts)} prompts ({synthesized} synthesized)")
+        return manifest
+
+def find_prompt(manifest: Dict[str, Any], answer_id: str, answer_text: str) -> Optional[str]:
+    """
+    回答に対応する事前合成済み音声のキーを検索
+    回答テキストが合成時から変わっている場合は使用しない
+
+    Args:
+        manifest: 音声マニフェスト
+        answer_id: Q&A ID
+        answer_text: 現在の回答テキスト
+
+    Returns:
+        音声オブジェクトのキー（該当しない場合はNone）
+    """
+    prompt = manifest.get('prompts', {}).get(answer_id)
+    if prompt is None:
+        return None
+    if prompt['hash'] != audio_hash(answer_text, manifest.get('voiceId', ''), manifest.get('engine', '')):
+        return None
+    return prompt['key']
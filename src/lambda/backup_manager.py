@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# バックアップの保存先
+# 注：qa-data/ はKnowledge Baseのデータソース対象のため、別プレフィックスに配置する
+BACKUP_PREFIX = 'knowledge-artifacts/backup'
+BACKUP_MANIFEST_KEY = f'{BACKUP_PREFIX}/manifest.json'
+
+class BackupManager:
+    """
+    Q&Aデータのコンテンツアドレス型バックアップ
+    内容（SHA-256）単位でオブジェクトを保存し、バージョン一覧はマニフェストで管理する
+    """
+    def __init__(self, s3_client, bucket: str, source_key: str = 'qa-data/qa-knowledge.json',
+                 retention_count: int = 30, retention_days: int = 90):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.source_key = source_key
+        self.retention_count = retention_count
+        self.retention_days = retention_days
+
+    def load_manifest(self) -> Dict[str, Any]:
+        """マニフェストを読み込む（未作成の場合は空のマニフェスト）"""
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=BACKUP_MANIFEST_KEY)
+            return json.loads(response['Body'].read().decode('utf-8'))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return {'versions': []}
+            raise
+
+    def save_manifest(self, manifest: Dict[str, Any]):
+        """マニフェストを保存"""
+        manifest['updatedAt'] = datetime.utcnow().isoformat()
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=BACKUP_MANIFEST_KEY,
+            Body=json.dumps(manifest, ensure_ascii=False),
+            ContentType='application/json'
+        )
+
+    def object_key(self, content_hash: str) -> str:
+        """内容ハッシュに対応するバックアップオブジェクトのキー"""
+        return f'{BACKUP_PREFIX}/objects/{content_hash}.json'
+
+    def backup(self) -> Dict[str, Any]:
+        """
+        現在のデータをバックアップ
+        ETagが前回と同じ場合はコピーを行わない
+
+        Returns:
+            バックアップ結果（作成したバージョンまたはスキップ理由）
+        """
+        manifest = self.load_manifest()
+        versions = manifest['versions']
+        latest = versions[-1] if versions else None
+
+        head = self.s3.head_object(Bucket=self.bucket, Key=self.source_key)
+        etag = head['ETag']
+
+        if latest and latest['etag'] == etag:
+            logger.info(f"Backup skipped: content unchanged since version {latest['version']}")
+            return {'status': 'unchanged', 'version': latest['version'], 'hash': latest['hash']}
+
+        # ETagが変わった場合のみ本文を取得して内容ハッシュを算出
+        response = self.s3.get_object(Bucket=self.bucket, Key=self.source_key, IfMatch=etag)
+        content_hash = hashlib.sha256(response['Body'].read()).hexdigest()
+
+        known_hashes = {v['hash'] for v in versions}
+        backup_key = self.object_key(content_hash)
+
+        if content_hash not in known_hashes:
+            self.s3.copy_object(
+                CopySource={'Bucket': self.bucket, 'Key': self.source_key},
+                CopySourceIfMatch=etag,
+                Bucket=self.bucket,
+                Key=backup_key
+            )
+            logger.info(f"Backup created: {backup_key}")
+        else:
+            # 以前の内容に戻った場合は既存オブジェクトを参照するのみ
+            logger.info(f"Backup content already stored: {backup_key}")
+
+        entry = {
+            'version': (latest['version'] + 1) if latest else 1,
+            'hash': content_hash,
+            'etag': etag,
+            'key': backup_key,
+            'size': head.get('ContentLength', 0),
+            'createdAt': datetime.utcnow().isoformat()
+        }
+        versions.append(entry)
+
+        pruned = self.prune(manifest)
+        self.save_manifest(manifest)
+
+        return {'status': 'created', 'version': entry['version'], 'hash': content_hash, 'pruned': pruned}
+
+    def prune(self, manifest: Dict[str, Any]) -> List[int]:
+        """
+        保持ポリシーを超えたバージョンをマニフェストから除外し、
+        どのバージョンからも参照されなくなったオブジェクトを削除
+
+        Returns:
+            除外したバージョン番号のリスト
+        """
+        versions = manifest['versions']
+        cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).isoformat()
+
+        # 最新バージョンは常に保持する
+        keep = []
+        for idx, entry in enumerate(versions):
+            is_latest = idx == len(versions) - 1
+            within_count = idx >= len(versions) - self.retention_count
+            if is_latest or (within_count and entry['createdAt'] >= cutoff):
+                keep.append(entry)
+
+        removed = [v for v in versions if v not in keep]
+        if not removed:
+            return []
+
+        kept_hashes = {v['hash'] for v in keep}
+        orphaned_keys = sorted({v['key'] for v in removed if v['hash'] not in kept_hashes})
+
+        for key in orphaned_keys:
+            self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+        manifest['versions'] = keep
+        logger.info(f"Pruned {len(removed)} backup versions ({len(orphaned_keys)} objects deleted)")
+        return [v['version'] for v in removed]
+
+    def find_version(self, manifest: Dict[str, Any], version: Any) -> Optional[Dict[str, Any]]:
+        """バージョン番号または内容ハッシュ（先頭一致）でバージョンを検索"""
+        for entry in reversed(manifest['versions']):
+            if str(entry['version']) == str(version):
+                return entry
+            if isinstance(version, str) and len(version) >= 8 and entry['hash'].startswith(version):
+                return entry
+        return None
+
+    def restore(self, version: Any) -> Dict[str, Any]:
+        """
+        指定バージョンを復元
+        マニフェストのみを参照するため、バックアップのLISTは行わない
+
+        Args:
+            version: バージョン番号または内容ハッシュ
+
+        Returns:
+            復元結果
+        """
+        manifest = self.load_manifest()
+        entry = self.find_version(manifest, version)
+        if entry is None:
+            raise ValueError(f"Backup version not found: {version}")
+
+        self.s3.copy_object(
+            CopySource={'Bucket': self.bucket, 'Key': entry['key']},
+            Bucket=self.bucket,
+            Key=self.source_key,
+            ContentType='application/json',
+            MetadataDirective='REPLACE'
+        )
+
+        logger.info(f"Restored version {entry['version']} ({entry['hash']}) to {self.source_key}")
+        return {'status': 'restored', 'version': entry['version'], 'hash': entry['hash']}
@@ -0,0 +1,291 @@
+"""
+録音済み通話の書き起こしコーパスを回答パイプラインに一括投入し、
+回答品質（recall@k）とレイテンシを評価するバッチ実行モード
+
+使用例:
+    python src/lambda/batch_evaluator.py transcripts.jsonl --output results.jsonl --offline
+
+コーパスは1行1件のJSONL:
+    {"id": "call-0001", "transcript": "レシートが出ない", "expected_ids": ["qa-003"]}
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+from typing import Dict, Any, List, Optional, Iterator
+
+# オフライン実行時もboto3クライアントの初期化に失敗しないようにリージョンを補完
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+
+from botocore.exceptions import ClientError
+
+import helpdesk_processor
+from error_handler import HelpdeskError, handle_error, validate_input
+from static_responses import STATIC_RESPONSES_KEY, build_static_table
+from vector_index import VectorIndex, VECTOR_INDEX_KEY, hashed_ngram_embedding
+
+logger = logging.getLogger()
+
+DEFAULT_QA_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'qa-knowledge.json'
+)
+
+class LocalS3Client:
+    """メモリ上のオブジェクトを返すS3クライアントの代替"""
+    def __init__(self, objects: Dict[str, bytes]):
+        self.objects = objects
+
+    def _get(self, key: str) -> bytes:
+        if key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': key}}, 'GetObject')
+        return self.objects[key]
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        return {'Body': io.BytesIO(self._get(Key))}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        return {'ETag': '"local"', 'ContentLength': len(self._get(Key))}
+
+class LocalBedrockRuntime:
+    """
+    Bedrock Runtimeクライアントの代替
+    埋め込みモデルには簡易埋め込みを、生成モデルには固定の回答を返す
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        request = json.loads(body)
+        if 'inputText' in request:
+            embedding = hashed_ngram_embedding(request['inputText'], request.get('dimensions', 256))
+            return {'body': io.BytesIO(json.dumps({'embedding': embedding}).encode('utf-8'))}
+
+        if self.latency:
+            time.sleep(self.latency)
+        payload = {
+            'content': [{'type': 'text', 'text': 'ローカル生成の回答です。'}],
+            'completion': 'ローカル生成の回答です。'
+        }
+        return {'body': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+def install_clients(s3=None, bedrock_runtime=None, bedrock_agent_runtime=None):
+    """
+    helpdesk_processorが使用するAWSクライアントを差し替える
+
+    Args:
+        s3: S3クライアント
+        bedrock_runtime: Bedrock Runtimeクライアント
+        bedrock_agent_runtime: Bedrock Agent Runtimeクライアント
+    """
+    if s3 is not None:
+        helpdesk_processor.s3 = s3
+    if bedrock_runtime is not None:
+        helpdesk_processor.bedrock_runtime = bedrock_runtime
+    if bedrock_agent_runtime is not None:
+        helpdesk_processor.bedrock_agent_runtime = bedrock_agent_runtime
+
+def install_local_stubs(qa_data_path: str = DEFAULT_QA_DATA_PATH, generation_latency: float = 0.0):
+    """
+    オフライン実行用にローカルの代替クライアントを設定
+    Knowledge Baseは使用せず、ローカルの埋め込み行列によるフォールバック検索で評価する
+    """
+    with open(qa_data_path, 'rb') as f:
+        qa_body = f.read()
+
+    qa_data = json.loads(qa_body.decode('utf-8'))
+    dimensions = helpdesk_processor.EMBEDDING_DIMENSIONS
+    index = VectorIndex.build(qa_data, lambda text: hashed_ngram_embedding(text, dimensions))
+    static_table = build_static_table(qa_data)
+
+    install_clients(
+        s3=LocalS3Client({
+            'qa-data/qa-knowledge.json': qa_body,
+            VECTOR_INDEX_KEY: index.to_bytes(),
+            STATIC_RESPONSES_KEY: json.dumps(static_table, ensure_ascii=False).encode('utf-8')
+        }),
+        bedrock_runtime=LocalBedrockRuntime(generation_latency)
+    )
+    helpdesk_processor.KNOWLEDGE_BASE_ID = None
+    helpdesk_processor.KNOWLEDGE_BUCKET = helpdesk_processor.KNOWLEDGE_BUCKET or 'local'
+
+def read_corpus(path: str) -> Iterator[Dict[str, Any]]:
+    """コーパスを1件ずつ読み込む"""
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item.setdefault('id', f'line-{line_number}')
+            yield item
+
+def evaluate_item(item: Dict[str, Any], k: int) -> Dict[str, Any]:
+    """
+    1件の書き起こしをパイプラインに通して評価
+
+    Args:
+        item: コーパスの1件
+        k: recall@kのk
+
+    Returns:
+        評価結果
+    """
+    transcript = item.get('transcript') or item.get('transcribedText', '')
+    expected_ids = item.get('expected_ids') or []
+    trace: Dict[str, Any] = {}
+
+    start_time = time.time()
+    try:
+        # 本番と同じく入力検証・正規化を経由する（棄却された入力はエラー応答のカテゴリで評価）
+        event = {'Details': {'Parameters': {'transcribedText': transcript}}}
+        question, question_key = validate_input(event)
+        answer, confidence, category = helpdesk_processor.process_question(
+            question, trace, question_key=question_key
+        )
+        error = None
+    except HelpdeskError as e:
+        error_response = handle_error(e, 'validate_input')
+        answer, confidence, category = error_response['response'], 0.0, error_response['category']
+        error = None
+    except Exception as e:
+        answer, confidence, category = "", 0.0, "error"
+        error = str(e)
+    total_time = time.time() - start_time
+
+    candidates = trace.get('candidates', [])[:k]
+    result = {
+        'id': item['id'],
+        'transcript': transcript,
+        'answer': answer,
+        'confidence': confidence,
+        'category': category,
+        'timings': dict(trace.get('timings', {}), total=total_time),
+        'candidates': candidates,
+        'expected_ids': expected_ids,
+        'hit': bool(set(expected_ids) & set(candidates)) if expected_ids else None,
+        # 信頼度校正（reranker.py）の学習用
+        'features': trace.get('features'),
+        'top1_correct': (bool(candidates) and candidates[0] in expected_ids) if expected_ids else None
+    }
+    if error:
+        result['error'] = error
+    return result
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近傍順位法によるパーセンタイル"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    # 順位は ceil(p/100 * n)（p*nを先に計算し、0.07*100のような浮動小数点の誤差で切り上がるのを防ぐ）
+    index = max(math.ceil(p * len(ordered) / 100.0) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+def summarize(results: List[Dict[str, Any]], k: int) -> Dict[str, Any]:
+    """評価結果を集計"""
+    labeled = [r for r in results if r['hit'] is not None]
+    stages = sorted({stage for r in results for stage in r['timings']})
+
+    latency = {}
+    for stage in stages:
+        values = [r['timings'][stage] for r in results if stage in r['timings']]
+        latency[stage] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': max(values)
+        }
+
+    categories: Dict[str, int] = {}
+    for r in results:
+        categories[r['category']] = categories.get(r['category'], 0) + 1
+
+    return {
+        'total': len(results),
+        'errors': sum(1 for r in results if 'error' in r),
+        f'recall@{k}': (sum(1 for r in labeled if r['hit']) / len(labeled)) if labeled else None,
+        'labeled': len(labeled),
+        'generationRate': (
+            sum(1 for r in results if 'generation' in r['timings']) / len(results)
+        ) if results else None,
+        'latency': latency,
+        'categories': categories
+    }
+
+def run_batch(corpus_path: str, output_path: str, workers: int = 4, k: int = 3) -> Dict[str, Any]:
+    """
+    コーパスを並列度を制限したスレッドプールで処理し、結果をJSONLで出力
+
+    Args:
+        corpus_path: 入力コーパス（JSONL）
+        output_path: 結果の出力先（JSONL）
+        workers: 同時実行数
+        k: recall@kのk
+
+    Returns:
+        集計結果
+    """
+    results = []
+    # 実行中のタスク数を制限し、コーパス全体をメモリに載せない
+    max_pending = workers * 2
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(output_path, 'w', encoding='utf-8') as output:
+        pending = set()
+
+        def drain(return_when):
+            done, remaining = wait(pending, return_when=return_when)
+            for future in done:
+                result = future.result()
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+                results.append(result)
+            return remaining
+
+        for item in read_corpus(corpus_path):
+            pending.add(executor.submit(evaluate_item, item, k))
+            if len(pending) >= max_pending:
+                pending = drain(FIRST_COMPLETED)
+
+        if pending:
+            drain(ALL_COMPLETED)
+
+    summary = summarize(results, k)
+    logger.info(f"Batch evaluation completed: {summary['total']} items")
+    return summary
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='書き起こしコーパスによる回答品質・レイテンシの一括評価')
+    parser.add_argument('corpus', help='入力コーパス（JSONL）')
+    parser.add_argument('--output', default='evaluation-results.jsonl', help='結果の出力先（JSONL）')
+    parser.add_argument('--summary', help='集計結果の出力先（JSON）。省略時は標準出力')
+    parser.add_argument('--workers', type=int, default=4, help='同時実行数')
+    parser.add_argument('-k', type=int, default=3, help='recall@kのk')
+    parser.add_argument('--offline', action='store_true', help='AWSに接続せずローカルの代替クライアントで実行')
+    parser.add_argument('--qa-data', default=DEFAULT_QA_DATA_PATH, help='オフライン実行時のQ&Aデータ')
+    parser.add_argument('--generation-latency', type=float, default=0.0,
+                        help='オフライン実行時に生成へ加える擬似レイテンシ（秒）')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING'))
+
+    if args.offline:
+        install_local_stubs(args.qa_data, args.generation_latency)
+
+    summary = run_batch(args.corpus, args.output, workers=args.workers, k=args.k)
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
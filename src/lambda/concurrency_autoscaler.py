@@ -0,0 +1,374 @@
+"""
+通話量予測にもとづくProvisioned Concurrencyの自動調整
+
+ヘルプデスクの着信は店舗の営業時間に連動するため、過去の呼び出し数と応答時間から
+次の1時間の同時実行数を季節性モデル（同じ曜日・時刻の実績）で予測し、
+helpdesk_processorのエイリアスのProvisioned Concurrencyを事前に調整する
+EventBridgeのスケジュール（毎時50分）で実行される
+
+メトリクスの記録とオフラインでの検証（dry-run）:
+    python src/lambda/concurrency_autoscaler.py --record metrics.json --function automated-helpdesk-processor-production
+    python src/lambda/concurrency_autoscaler.py --fixture metrics.json --at 2025-06-02T08:50:00
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+# オフライン実行時もboto3クライアントの初期化に失敗しないようにリージョンを補完
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+
+import boto3
+from botocore.exceptions import ClientError
+
+import structured_logger
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# AWSクライアント
+cloudwatch = boto3.client('cloudwatch')
+lambda_client = boto3.client('lambda')
+
+# 環境変数
+ENVIRONMENT = os.environ.get('ENVIRONMENT', 'unknown')
+TARGET_FUNCTION_NAME = os.environ.get('TARGET_FUNCTION_NAME', f'automated-helpdesk-processor-{ENVIRONMENT}')
+TARGET_ALIAS = os.environ.get('TARGET_ALIAS', 'live')
+PROVISIONED_MIN = int(os.environ.get('PROVISIONED_MIN', '0'))
+PROVISIONED_MAX = int(os.environ.get('PROVISIONED_MAX', '20'))
+# 予測に使用する過去の週数と、古い週ほど小さくする重みの減衰率
+FORECAST_WEEKS = int(os.environ.get('FORECAST_WEEKS', '4'))
+FORECAST_DECAY = float(os.environ.get('FORECAST_DECAY', '0.6'))
+# 予測値に対する余裕（予測誤差・バーストへの備え）
+FORECAST_HEADROOM = float(os.environ.get('FORECAST_HEADROOM', '1.3'))
+# 応答時間のメトリクスがない場合の想定（秒）
+DEFAULT_RESPONSE_TIME = float(os.environ.get('DEFAULT_RESPONSE_TIME', '3'))
+# メトリクスの集計間隔（秒）。1時間のうち最も混雑した区間の同時実行数を使用する
+METRIC_PERIOD = 300
+
+# 直近の実績と季節性の予測の比（当日の通話量の増減）を反映する時間数と範囲
+LEVEL_HOURS = 3
+LEVEL_MIN = 0.5
+LEVEL_MAX = 2.0
+
+# この値未満の予測は通話なしとみなす（閉店時間帯はProvisioned Concurrencyを解放）
+IDLE_CONCURRENCY = 0.05
+
+def _to_naive_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def _hour_of(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def fetch_metric_history(cloudwatch_client, function_name: str, environment: str,
+                         start: datetime, end: datetime, period: int = METRIC_PERIOD) -> Dict[str, Any]:
+    """
+    呼び出し数と応答時間の履歴を取得
+
+    Args:
+        cloudwatch_client: CloudWatchクライアント
+        function_name: 対象のLambda関数名
+        environment: 環境名（Helpdesk/QualityのResponseTimeの絞り込み）
+        start: 取得開始時刻（UTC）
+        end: 取得終了時刻（UTC）
+        period: 集計間隔（秒）
+
+    Returns:
+        メトリクスの履歴（save_fixtureで保存できる形式）
+    """
+    function_dimension = [{'Name': 'FunctionName', 'Value': function_name}]
+    search = (
+        "SEARCH('{Helpdesk/Quality,Environment,Category} MetricName=\"ResponseTime\" "
+        f"Environment=\"{environment}\"', 'Average', {period})"
+    )
+    queries = [
+        {
+            'Id': 'invocations',
+            'MetricStat': {
+                'Metric': {'Namespace': 'AWS/Lambda', 'MetricName': 'Invocations', 'Dimensions': function_dimension},
+                'Period': period,
+                'Stat': 'Sum'
+            }
+        },
+        {
+            # カテゴリ別の応答時間を平均した時系列
+            'Id': 'response_time',
+            'Expression': f'AVG({search})',
+            'Period': period
+        },
+        {
+            # ResponseTimeが記録されていない期間の代替（ミリ秒）
+            'Id': 'duration',
+            'MetricStat': {
+                'Metric': {'Namespace': 'AWS/Lambda', 'MetricName': 'Duration', 'Dimensions': function_dimension},
+                'Period': period,
+                'Stat': 'Average'
+            }
+        }
+    ]
+
+    series: Dict[str, Dict[str, float]] = {query['Id']: {} for query in queries}
+    paginator = cloudwatch_client.get_paginator('get_metric_data')
+    for page in paginator.paginate(MetricDataQueries=queries, StartTime=start, EndTime=end):
+        for result in page['MetricDataResults']:
+            for timestamp, value in zip(result['Timestamps'], result['Values']):
+                series[result['Id']][_to_naive_utc(timestamp).isoformat()] = value
+
+    return {
+        'functionName': function_name,
+        'environment': environment,
+        'period': period,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'series': series
+    }
+
+def save_fixture(path: str, history: Dict[str, Any]):
+    """メトリクスの履歴をファイルに保存（dry-run用）"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+def load_fixture(path: str) -> Dict[str, Any]:
+    """保存したメトリクスの履歴を読み込む"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def hourly_peak_concurrency(history: Dict[str, Any],
+                            default_response_time: float = DEFAULT_RESPONSE_TIME) -> Dict[datetime, float]:
+    """
+    時間帯ごとの最大同時実行数を推定（リトルの法則: 到着率 × 応答時間）
+
+    Args:
+        history: fetch_metric_historyの結果
+        default_response_time: 応答時間のメトリクスがない場合の想定（秒）
+
+    Returns:
+        時刻（時単位）→ その1時間で最も混雑した区間の同時実行数
+        最初の呼び出し以降で呼び出しのなかった時間帯は0、最初の呼び出しより前の時間帯は含めない
+    """
+    period = history['period']
+    series = history['series']
+    response_times = {
+        datetime.fromisoformat(ts): value for ts, value in series.get('response_time', {}).items()
+    }
+    durations = {
+        datetime.fromisoformat(ts): value / 1000.0 for ts, value in series.get('duration', {}).items()
+    }
+
+    invocations_series = {
+        datetime.fromisoformat(ts): value for ts, value in series.get('invocations', {}).items()
+    }
+    hourly: Dict[datetime, float] = {}
+    if not invocations_series:
+        return hourly
+
+    # CloudWatchは呼び出しのない区間のデータを返さないため、最初の呼び出し以降の全時間帯を0で初期化
+    # （それより前は関数の作成前の可能性があるため実績なしとし、前日までの同時刻の実績で予測する）
+    end = datetime.fromisoformat(history['end'])
+    hour = _hour_of(min(invocations_series))
+    while hour < end:
+        hourly[hour] = 0.0
+        hour += timedelta(hours=1)
+
+    for timestamp, invocations in invocations_series.items():
+        response_time = response_times.get(timestamp) or durations.get(timestamp) or default_response_time
+        concurrency = invocations / period * response_time
+        hour = _hour_of(timestamp)
+        hourly[hour] = max(hourly.get(hour, 0.0), concurrency)
+
+    return hourly
+
+def seasonal_baseline(hourly: Dict[datetime, float], target_hour: datetime,
+                      weeks: int = FORECAST_WEEKS, decay: float = FORECAST_DECAY) -> Optional[float]:
+    """
+    同じ曜日・時刻の過去の実績の加重平均（直近の週ほど重い）
+    週単位の履歴がない場合は直近7日間の同時刻の実績を使用する
+
+    Returns:
+        季節性による予測値（実績がない場合はNone）
+    """
+    for step, count in ((timedelta(weeks=1), weeks), (timedelta(days=1), 7)):
+        observations = [
+            (hourly[target_hour - step * k], decay ** (k - 1))
+            for k in range(1, count + 1)
+            if target_hour - step * k in hourly
+        ]
+        if observations:
+            return sum(value * weight for value, weight in observations) / sum(weight for _, weight in observations)
+    return None
+
+def seasonal_forecast(hourly: Dict[datetime, float], target_hour: datetime,
+                      weeks: int = FORECAST_WEEKS, decay: float = FORECAST_DECAY) -> Dict[str, Any]:
+    """
+    対象時間帯の同時実行数を予測
+    季節性の予測値に、直近の実績と季節性の予測の比（当日の増減）を掛ける
+
+    Args:
+        hourly: hourly_peak_concurrencyの結果
+        target_hour: 予測対象の時間帯（時単位）
+        weeks: 使用する過去の週数
+        decay: 古い週の重みの減衰率
+
+    Returns:
+        予測結果（forecast, seasonal, level）
+    """
+    seasonal = seasonal_baseline(hourly, target_hour, weeks, decay)
+    if seasonal is None:
+        return {'forecast': None, 'seasonal': None, 'level': 1.0}
+
+    actual = baseline = 0.0
+    for offset in range(1, LEVEL_HOURS + 1):
+        hour = target_hour - timedelta(hours=offset)
+        expected = seasonal_baseline(hourly, hour, weeks, decay)
+        if hour in hourly and expected is not None:
+            actual += hourly[hour]
+            baseline += expected
+    level = min(LEVEL_MAX, max(LEVEL_MIN, actual / baseline)) if baseline > 0 else 1.0
+
+    return {'forecast': seasonal * level, 'seasonal': seasonal, 'level': level}
+
+def target_concurrency(forecast: Optional[float], headroom: float = FORECAST_HEADROOM,
+                       minimum: int = PROVISIONED_MIN, maximum: int = PROVISIONED_MAX) -> int:
+    """予測値から設定するProvisioned Concurrencyを算出（予測できない場合は上限）"""
+    if forecast is None:
+        return maximum
+    if forecast < IDLE_CONCURRENCY:
+        return minimum
+    return min(maximum, max(minimum, math.ceil(forecast * headroom)))
+
+class ProvisionedConcurrencyScaler:
+    """エイリアスのProvisioned Concurrencyの取得・変更"""
+    def __init__(self, lambda_client, function_name: str, alias: str, dry_run: bool = False):
+        self.lambda_client = lambda_client
+        self.function_name = function_name
+        self.alias = alias
+        self.dry_run = dry_run
+
+    def current(self) -> int:
+        """現在の設定値（未設定の場合は0）"""
+        try:
+            response = self.lambda_client.get_provisioned_concurrency_config(
+                FunctionName=self.function_name,
+                Qualifier=self.alias
+            )
+            return response['RequestedProvisionedConcurrentExecutions']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ProvisionedConcurrencyConfigNotFoundException':
+                return 0
+            raise
+
+    def apply(self, target: int, current: int) -> str:
+        """
+        設定を変更
+
+        Returns:
+            実行した操作（unchanged, updated, removed, dry_run）
+        """
+        if target == current:
+            return 'unchanged'
+        if self.dry_run:
+            return 'dry_run'
+
+        if target == 0:
+            self.lambda_client.delete_provisioned_concurrency_config(
+                FunctionName=self.function_name,
+                Qualifier=self.alias
+            )
+            return 'removed'
+
+        self.lambda_client.put_provisioned_concurrency_config(
+            FunctionName=self.function_name,
+            Qualifier=self.alias,
+            ProvisionedConcurrentExecutions=target
+        )
+        return 'updated'
+
+def plan(history: Dict[str, Any], now: datetime, weeks: int = FORECAST_WEEKS) -> Dict[str, Any]:
+    """
+    次の1時間のProvisioned Concurrencyを決定
+
+    Args:
+        history: メトリクスの履歴
+        now: 現在時刻（UTC）
+        weeks: 使用する過去の週数
+
+    Returns:
+        決定内容（targetHour, forecast, seasonal, level, target）
+    """
+    target_hour = _hour_of(now) + timedelta(hours=1)
+    forecast = seasonal_forecast(hourly_peak_concurrency(history), target_hour, weeks)
+    return dict(
+        forecast,
+        targetHour=target_hour.isoformat(),
+        target=target_concurrency(forecast['forecast'])
+    )
+
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Provisioned Concurrencyの定期調整
+    EventBridgeのスケジュールで実行される（event['dryRun']がTrueの場合は変更しない）
+    """
+    log = structured_logger.begin('concurrency_autoscaler', function=TARGET_FUNCTION_NAME, alias=TARGET_ALIAS)
+
+    try:
+        now = datetime.utcnow()
+        history = fetch_metric_history(
+            cloudwatch, TARGET_FUNCTION_NAME, ENVIRONMENT,
+            now - timedelta(weeks=FORECAST_WEEKS, hours=1), now
+        )
+        decision = plan(history, now)
+
+        scaler = ProvisionedConcurrencyScaler(
+            lambda_client, TARGET_FUNCTION_NAME, TARGET_ALIAS, dry_run=bool(event.get('dryRun'))
+        )
+        decision['previous'] = scaler.current()
+        decision['action'] = scaler.apply(decision['target'], decision['previous'])
+        log.set(**decision)
+
+        return {
+            'statusCode': 200,
+            'body': decision
+        }
+
+    except Exception as e:
+        log.error('lambda_handler', e)
+        raise
+
+    finally:
+        log.emit()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='通話量予測にもとづくProvisioned Concurrencyの調整')
+    parser.add_argument('--fixture', help='記録済みのメトリクス（指定時はAWSに接続せずに予測のみ行う）')
+    parser.add_argument('--record', help='CloudWatchから取得したメトリクスの保存先')
+    parser.add_argument('--function', default=TARGET_FUNCTION_NAME, help='対象のLambda関数名')
+    parser.add_argument('--environment', default=ENVIRONMENT, help='環境名')
+    parser.add_argument('--weeks', type=int, default=FORECAST_WEEKS, help='予測に使用する過去の週数')
+    parser.add_argument('--at', help='予測を行う時刻（UTC・ISO形式）。省略時は記録の終了時刻または現在時刻')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        end = datetime.fromisoformat(args.at) if args.at else datetime.utcnow()
+        history = fetch_metric_history(
+            cloudwatch, args.function, args.environment, end - timedelta(weeks=args.weeks, hours=1), end
+        )
+        save_fixture(args.record, history)
+        print(f"Recorded {len(history['series']['invocations'])} datapoints to {args.record}")
+        return 0
+
+    if not args.fixture:
+        parser.error('--fixture または --record を指定してください')
+
+    history = load_fixture(args.fixture)
+    now = datetime.fromisoformat(args.at) if args.at else datetime.fromisoformat(history['end'])
+    print(json.dumps(plan(history, now, args.weeks), ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
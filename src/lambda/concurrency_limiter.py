@@ -0,0 +1,223 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+class FleetConcurrencyLimit:
+    """
+    コンテナ間で共有する同時実行数の上限
+    共有ストア（single_flightのリースストア）のslots個のリースを実行枠として使用する
+    Lambdaの1コンテナは同時に1リクエストのみ処理するため、コンテナ内の上限だけでは
+    スケールアウトした新しいコンテナの分だけフリート全体の同時実行数が増える
+    リースは期限付きのため、処理中に終了したコンテナの枠も期限切れで解放される
+    """
+    def __init__(self, store, slots: int, lease_ttl: float = 30.0, poll_interval: float = 0.2,
+                 key_prefix: str = 'generation-slot', sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.time):
+        self.store = store
+        self.slots = slots
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.key_prefix = key_prefix
+        self.sleep = sleep
+        self.clock = clock
+
+    def acquire(self, wait_until: Optional[float] = None) -> Optional[tuple[str, str]]:
+        """
+        実行枠のリースを取得
+
+        Args:
+            wait_until: 枠が空くのを待つ期限（epoch秒）。Noneの場合は空くまで待機する
+
+        Returns:
+            （リースのキー, 所有者）。期限までに取得できない場合はNone
+        """
+        owner = str(uuid.uuid4())
+        while True:
+            # 特定の枠に取得が集中しないよう開始位置をずらす
+            start = random.randrange(self.slots)
+            for offset in range(self.slots):
+                key = f'{self.key_prefix}#{(start + offset) % self.slots}'
+                if self.store.acquire(key, owner, self.lease_ttl):
+                    return key, owner
+            if wait_until is not None and self.clock() + self.poll_interval > wait_until:
+                return None
+            self.sleep(self.poll_interval)
+
+    def release(self, lease: tuple[str, str]):
+        """実行枠のリースを解放"""
+        key, owner = lease
+        self.store.release(key, owner)
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Bedrock呼び出しの同時実行数を適応的に制限する（AIMD + レイテンシ勾配）
+
+    - 成功時は上限を加算的に増やす（レイテンシが基準を大きく超える場合は緩やかに減らす）
+    - スロットリング時は上限を乗算的に減らす（上限を1未満に下げるのはスロットリングのみ）
+    - Lambdaの1コンテナは同時に1リクエストのみ処理するため、上限が1未満の場合は
+      その割合だけ受け付ける（フリート全体での流量制御として働く）
+    - コンテナ内の上限は新しいコンテナには及ばないため、フリート全体の同時実行数は
+      fleet（FleetConcurrencyLimit）で制限する
+    """
+    def __init__(self, initial_limit: float = 1.0, min_limit: float = 0.1, max_limit: float = 32.0,
+                 increase: float = 1.0, backoff: float = 0.5, latency_tolerance: float = 2.0,
+                 smoothing: float = 0.2, baseline_smoothing: float = 0.02, recovery_interval: float = 10.0, clock: Callable[[], float] = time.time,
+                 rand: Callable[[], float] = random.random, fleet: Optional[FleetConcurrencyLimit] = None):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.recovery_interval = recovery_interval
+        self.clock = clock
+        self.rand = rand
+        self.fleet = fleet
+
+        self.inflight = 0
+        self.last_throttle = 0.0
+        self.baseline_latency: Optional[float] = None
+        self.recent_latency: Optional[float] = None
+        self.condition = threading.Condition()
+        self.counters = {'attempts': 0, 'throttled': 0, 'shed': 0}
+        # 呼び出し中のスレッドが保持するフリートの実行枠
+        self.leases = threading.local()
+
+    def expected_latency(self) -> float:
+        """直近の生成レイテンシ（未計測の場合は0）"""
+        return self.recent_latency or 0.0
+
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """
+        生成の実行枠を取得
+        上限に達している場合は、期限内に生成を完了できる見込みがある間だけ待機する
+
+        Args:
+            deadline: 回答を返すべき時刻（epoch秒）。Noneの場合は負荷制限せず、枠が空くまで待機する
+                （バッチ評価など応答期限のない呼び出し用）
+
+        Returns:
+            取得できた場合はTrue（呼び出し側は同じスレッドでreleaseを呼ぶこと）。取得できない場合は負荷制限
+        """
+        if not self._acquire_local(deadline):
+            return False
+        if self.fleet is None:
+            return True
+
+        try:
+            wait_until = deadline - self.expected_latency() if deadline is not None else None
+            lease = self.fleet.acquire(wait_until)
+        except ClientError as e:
+            # 共有ストアの障害時はコンテナ内の上限のみで制御する
+            logger.error(f"Fleet concurrency store error: {e}")
+            self.leases.current = None
+            return True
+        if lease is None:
+            with self.condition:
+                self.counters['shed'] += 1
+            self._release_local()
+            return False
+        self.leases.current = lease
+        return True
+
+    def _acquire_local(self, deadline: Optional[float]) -> bool:
+        with self.condition:
+            while True:
+                if self.limit < 1.0:
+                    self._recover()
+
+                if self.limit < 1.0:
+                    # 上限が1未満の場合は割合で受け付ける
+                    if self.inflight == 0 and (deadline is None or self.rand() < self.limit):
+                        break
+                    if deadline is not None:
+                        self.counters['shed'] += 1
+                        return False
+                elif self.inflight < int(self.limit):
+                    break
+
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+
+                remaining = deadline - self.clock() - self.expected_latency()
+                if remaining <= 0:
+                    self.counters['shed'] += 1
+                    return False
+                self.condition.wait(remaining)
+
+            self.inflight += 1
+            self.counters['attempts'] += 1
+            return True
+
+    def _recover(self):
+        """
+        スロットリングが一定時間発生していなければ上限を戻す
+        負荷制限中は成功のフィードバックが少ないため、時間経過でも回復させる
+        """
+        now = self.clock()
+        if now - self.last_throttle >= self.recovery_interval:
+            self.limit = min(1.0, self.limit * 2)
+            self.last_throttle = now
+
+    def release(self):
+        """生成の実行枠を返却"""
+        lease = getattr(self.leases, 'current', None)
+        self.leases.current = None
+        if lease is not None:
+            try:
+                self.fleet.release(lease)
+            except ClientError as e:
+                # 解放できなかった枠はリースの期限切れで解放される
+                logger.error(f"Failed to release fleet concurrency slot: {e}")
+        self._release_local()
+
+    def _release_local(self):
+        with self.condition:
+            self.inflight -= 1
+            self.condition.notify()
+
+    def on_success(self, latency: float):
+        """生成成功時のフィードバック"""
+        with self.condition:
+            if self.recent_latency is None:
+                self.recent_latency = latency
+                self.baseline_latency = latency
+            else:
+                # 直近値は短い窓、基準値は長い窓の指数移動平均
+                # （最小値を基準にすると生成レイテンシの通常のばらつきで常に混雑と判定される）
+                self.recent_latency += self.smoothing * (latency - self.recent_latency)
+                self.baseline_latency += self.baseline_smoothing * (latency - self.baseline_latency)
+
+            if self.recent_latency > self.baseline_latency * self.latency_tolerance:
+                # 混雑の兆候（レイテンシ勾配）があれば緩やかに減らす
+                # レイテンシだけでは負荷制限（上限1未満）に入らない
+                if self.limit > 1.0:
+                    self.limit = max(1.0, self.limit * 0.9)
+            elif self.limit < 1.0:
+                self.limit = min(1.0, self.limit + self.increase * 0.1)
+            else:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self.condition.notify()
+
+    def on_throttle(self):
+        """スロットリング発生時のフィードバック"""
+        with self.condition:
+            self.counters['throttled'] += 1
+            self.last_throttle = self.clock()
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def drain_counters(self) -> Dict[str, Any]:
+        """前回取得以降のカウンタと現在の上限を取得"""
+        with self.condition:
+            counters = dict(self.counters, limit=self.limit)
+            self.counters = {name: 0 for name in self.counters}
+            return counters
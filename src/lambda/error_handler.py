@@ -1,13 +1,20 @@
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any
 from enum import Enum
 
+import structured_logger
+from text_normalizer import normalize_transcript, is_noise, canonical_key
+
 logger = logging.getLogger()
 
+# 入力テキストの最大文字数（悪意のある長文を防ぐ）
+MAX_INPUT_LENGTH = 1000
+
 class ErrorType(Enum):
     """エラータイプの定義"""
     NO_INPUT = "no_input"
     TRANSCRIPTION_FAILED = "transcription_failed"
+    INPUT_TOO_LONG = "input_too_long"
     KNOWLEDGE_BASE_ERROR = "knowledge_base_error"
     BEDROCK_ERROR = "bedrock_error"
     LAMBDA_TIMEOUT = "lambda_timeout"
@@ -31,8 +38,6 @@ def handle_error(error: Exception, context: str) -> Dict[str, Any]:
     Returns:
         エラー応答データ
     """
-    logger.error(f"Error in {context}: {type(error).__name__}: {str(error)}")
-    
     # エラータイプ別の処理
     error_responses = {
         ErrorType.NO_INPUT: {
@@ -45,6 +50,11 @@ def handle_error(error: Exception, context: str) -> Dict[str, Any]:
             "retry": True,
             "log_level": "WARNING"
         },
+        ErrorType.INPUT_TOO_LONG: {
+            "message": "申し訳ございません。ご質問が長すぎるため処理できませんでした。要点を短くお話しください。",
+            "retry": True,
+            "log_level": "WARNING"
+        },
         ErrorType.KNOWLEDGE_BASE_ERROR: {
             "message": "申し訳ございません。情報の検索に失敗しました。技術サポートまでお問い合わせください。",
             "retry": False,
@@ -75,11 +85,11 @@ def handle_error(error: Exception, context: str) -> Dict[str, Any]:
     
     error_info = error_responses.get(error_type, error_responses[ErrorType.UNKNOWN])
     
-    # ログ出力
-    if error_info["log_level"] == "WARNING":
-        logger.warning(f"{context}: {error_type.value} - {str(error)}")
-    else:
-        logger.error(f"{context}: {error_type.value} - {str(error)}", exc_info=True)
+    # 呼び出しのログレコードに記録（ERRORの場合はスタックトレースと詳細フィールドも出力）
+    structured_logger.log_error(
+        context, error, error_type.value,
+        escalate=error_info["log_level"] != "WARNING"
+    )
     
     return {
         "response": error_info["message"],
@@ -89,37 +99,48 @@ def handle_error(error: Exception, context: str) -> Dict[str, Any]:
         "error": True
     }
 
-def validate_input(event: Dict[str, Any]) -> Optional[str]:
+def validate_input(event: Dict[str, Any]) -> tuple[str, str]:
     """
-    入力データの検証
+    入力データの検証と質問文の正規化
+    検索・生成などのネットワーク呼び出しの前に、空・雑音・長すぎる入力を除外する
     
     Args:
         event: Lambdaイベントデータ
     
     Returns:
-        エラーメッセージ（正常な場合はNone）
+        正規化した質問文と正規化キー（キャッシュ・重複排除・完全一致検索に使用）のタプル
+    
+    Raises:
+        HelpdeskError: 入力が不正な場合（handle_errorで応答に変換する）
     """
     # 必須フィールドの確認
     if not event:
-        return "イベントデータが空です"
+        raise HelpdeskError("イベントデータが空です", ErrorType.NO_INPUT)
     
     details = event.get('Details', {})
     if not details:
-        return "Detailsフィールドが見つかりません"
+        raise HelpdeskError("Detailsフィールドが見つかりません", ErrorType.NO_INPUT)
     
     parameters = details.get('Parameters', {})
     if not parameters:
-        return "Parametersフィールドが見つかりません"
+        raise HelpdeskError("Parametersフィールドが見つかりません", ErrorType.NO_INPUT)
     
     transcribed_text = parameters.get('transcribedText', '')
     if not transcribed_text or len(transcribed_text.strip()) == 0:
-        return "音声認識結果が空です"
+        raise HelpdeskError("音声認識結果が空です", ErrorType.NO_INPUT)
+    
+    # 文字数制限（正規化の前に確認し、長文の処理コストを避ける）
+    if len(transcribed_text) > MAX_INPUT_LENGTH:
+        raise HelpdeskError(f"入力テキストが長すぎます: {len(transcribed_text)}文字", ErrorType.INPUT_TOO_LONG)
+    
+    question = normalize_transcript(transcribed_text)
+    if not question:
+        raise HelpdeskError("言いよどみのみの入力です", ErrorType.NO_INPUT)
     
-    # 文字数制限（悪意のある長文を防ぐ）
-    if len(transcribed_text) > 1000:
-        return "入力テキストが長すぎます"
+    if is_noise(question):
+        raise HelpdeskError("音声認識結果が雑音と判定されました", ErrorType.TRANSCRIPTION_FAILED)
     
-    return None
+    return question, canonical_key(question)
 
 def format_error_for_connect(error_response: Dict[str, Any]) -> Dict[str, Any]:
     """
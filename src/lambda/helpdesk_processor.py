@@ -1,11 +1,28 @@
+import contextvars
+import functools
 import json
 import logging
 import os
 import time
-from typing import Dict, Any, Optional
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List
 import boto3
 from botocore.exceptions import ClientError
 
+import structured_logger
+from error_handler import HelpdeskError, handle_error, validate_input
+from ingestion_tracker import KNOWLEDGE_VERSION_KEY
+from concurrency_limiter import AdaptiveConcurrencyLimiter, FleetConcurrencyLimit
+from audio_prompts import AUDIO_MANIFEST_KEY, find_prompt
+from prompt_templates import PromptLibrary, build_request_body, is_claude_model, prompt_cache_min_tokens
+from quality_metrics import QualityMetrics
+from single_flight import SingleFlight, DynamoDBLeaseStore
+from text_normalizer import canonical_key
+from static_responses import STATIC_RESPONSES_KEY, lookup as lookup_static_response
+from reranker import Calibrator, CALIBRATION_KEY, reciprocal_rank_fusion, extract_features
+from vector_index import VectorIndex, VECTOR_INDEX_KEY, embed_with_bedrock
+
 # ログ設定
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
@@ -14,12 +31,79 @@ logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 bedrock_runtime = boto3.client('bedrock-runtime')
 bedrock_agent_runtime = boto3.client('bedrock-agent-runtime')
 s3 = boto3.client('s3')
+dynamodb = boto3.client('dynamodb')
 
 # 環境変数
 KNOWLEDGE_BASE_ID = os.environ.get('KNOWLEDGE_BASE_ID')
+# プロンプトキャッシュを使用する場合はprompt_templates.PROMPT_CACHE_MODELSに含まれるモデルを指定する（既定のモデルは非対応）
 BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'claude-3-5-sonnet-20241022')
 KNOWLEDGE_BUCKET = os.environ.get('KNOWLEDGE_BUCKET')
 COST_LIMIT_DAILY = float(os.environ.get('COST_LIMIT_DAILY', '10'))
+# ナレッジバージョンマーカーの確認間隔（秒）
+KNOWLEDGE_VERSION_CHECK_INTERVAL = float(os.environ.get('KNOWLEDGE_VERSION_CHECK_INTERVAL', '60'))
+# ローカルベクトル検索（Knowledge Base未設定・障害時のフォールバック）
+EMBEDDING_MODEL_ID = os.environ.get('EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v2:0')
+EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', '256'))
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', '1024'))
+VECTOR_MIN_SCORE = float(os.environ.get('VECTOR_MIN_SCORE', '0.35'))
+# 再ランキング対象とする各検索ソースの候補数
+RETRIEVAL_CANDIDATES = int(os.environ.get('RETRIEVAL_CANDIDATES', '5'))
+# 校正済みの正答確率がこの値未満の場合にBedrockで回答を生成
+GENERATION_CONFIDENCE_THRESHOLD = float(os.environ.get('GENERATION_CONFIDENCE_THRESHOLD', '0.5'))
+# 同一質問の同時リクエストの重複排除（テーブル未設定の場合はコンテナ内のみ）
+COALESCE_TABLE = os.environ.get('COALESCE_TABLE')
+COALESCE_WAIT_TIMEOUT = float(os.environ.get('COALESCE_WAIT_TIMEOUT', '5'))
+COALESCE_RESULT_TTL = float(os.environ.get('COALESCE_RESULT_TTL', '30'))
+# 生成プロンプトに含める回答例のトークン数の上限（0の場合は回答例を含めない）
+PROMPT_EXAMPLE_TOKEN_BUDGET = int(os.environ.get('PROMPT_EXAMPLE_TOKEN_BUDGET', '0'))
+# プロンプトキャッシュ対応モデルで、システムプロンプトをキャッシュの最小トークン数まで回答例で補う
+# キャッシュの書き込みは通常の1.25倍の料金となるため、ログのcacheReadTokensで効果を確認したうえで有効にする
+PROMPT_CACHE_PADDING = os.environ.get('PROMPT_CACHE_PADDING', 'false').lower() == 'true'
+# Connectへ回答を返すまでの上限（Contact FlowのLambda呼び出しTimeLimitより短くする）
+RESPONSE_DEADLINE_SECONDS = float(os.environ.get('RESPONSE_DEADLINE_SECONDS', '20'))
+# コンテナ内の生成の同時実行数の初期値（1コンテナは同時に1リクエストのみ処理するため1以下とする）
+BEDROCK_INITIAL_CONCURRENCY = float(os.environ.get('BEDROCK_INITIAL_CONCURRENCY', '1'))
+# フリート全体の生成の同時実行数の上限（COALESCE_TABLEのリースで制限。テーブル未設定の場合はコンテナ内のみ）
+BEDROCK_FLEET_CONCURRENCY = int(os.environ.get('BEDROCK_FLEET_CONCURRENCY', '8'))
+
+# 混雑時の応答（負荷制限で生成できず、検索結果もない場合）
+BUSY_MESSAGE = "申し訳ございません。現在システムが混雑しております。しばらくしてからおかけ直しください。"
+
+# 他のリクエストと共有しない結果（エラー・負荷制限による縮退応答）
+NON_SHAREABLE_CATEGORIES = {'generation_error', 'generation_throttled', 'shed'}
+
+# KB検索と質問文の埋め込みを並行実行するためのスレッドプール
+_retrieval_executor = ThreadPoolExecutor(max_workers=4)
+
+# ウォームコンテナ内のナレッジキャッシュ
+# ナレッジバージョンが変わった時点で破棄される
+_knowledge_cache: Dict[str, Any] = {
+    'version': None,
+    'checked_at': 0.0,
+    'qa_data': None,
+    'vector_index': None,
+    'calibrator': None,
+    'qa_by_id': None,
+    'static_responses': None,
+    'audio_prompts': None,
+    'prompt_library': None
+}
+
+metrics = QualityMetrics()
+
+_lease_store = DynamoDBLeaseStore(dynamodb, COALESCE_TABLE) if COALESCE_TABLE else None
+
+# Bedrock生成の適応的な同時実行制限
+_generation_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=BEDROCK_INITIAL_CONCURRENCY,
+    fleet=FleetConcurrencyLimit(_lease_store, BEDROCK_FLEET_CONCURRENCY) if _lease_store else None
+)
+
+_single_flight = SingleFlight(
+    _lease_store,
+    result_ttl=COALESCE_RESULT_TTL,
+    wait_timeout=COALESCE_WAIT_TIMEOUT
+)
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -34,10 +118,10 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         Connect Contact Flowに返す回答データ
     """
     start_time = time.time()
+    # 呼び出しごとに1件の構造化ログを出力（音声認識結果はサンプリング時・エラー時のみ）
+    log = structured_logger.begin('helpdesk_processor')
     
     try:
-        logger.info(f"Received event: {json.dumps(event)}")
-        
         # 入力データの取得
         contact_data = event.get('Details', {})
         parameters = contact_data.get('Parameters', {})
@@ -45,59 +129,266 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         contact_id = parameters.get('contactId', 'unknown')
         customer_phone = parameters.get('customerPhoneNumber', 'unknown')
         
-        logger.info(f"Contact ID: {contact_id}, Customer: {customer_phone}")
-        logger.info(f"Transcribed text: {transcribed_text}")
+        log.set(contactId=contact_id, customer=structured_logger.mask_phone(customer_phone),
+                textLength=len(transcribed_text))
+        log.verbose(transcript=transcribed_text)
         
-        # 入力検証
-        if not transcribed_text or len(transcribed_text.strip()) == 0:
+        # 入力検証と正規化（空・雑音・長文は検索や生成の前に応答する）
+        try:
+            question, question_key = validate_input(event)
+        except HelpdeskError as e:
+            error_response = handle_error(e, 'validate_input')
+            log.set(category=error_response['category'])
             return create_response(
-                "申し訳ございません。音声が聞き取れませんでした。もう一度お話しいただけますでしょうか。",
+                error_response['response'],
                 confidence=0.0,
-                category="no_input",
+                category=error_response['category'],
                 processing_time=time.time() - start_time
             )
         
-        # ナレッジベースから回答を取得
-        answer, confidence, category = get_answer_from_knowledge_base(transcribed_text)
+        # 回答期限（Lambdaの残り時間とContact Flowの待ち時間の短い方）
+        deadline = start_time + RESPONSE_DEADLINE_SECONDS
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            deadline = min(deadline, start_time + context.get_remaining_time_in_millis() / 1000.0 - 1.0)
         
-        # 回答が見つからない場合は、Bedrockで生成
-        if confidence < 0.5:
-            answer, confidence, category = generate_answer_with_bedrock(transcribed_text)
+        trace: Dict[str, Any] = {}
+        answer, confidence, category = process_question(question, trace, deadline, question_key)
         
         processing_time = time.time() - start_time
-        logger.info(f"Processing completed in {processing_time:.2f} seconds")
+        log.set(category=category, confidence=confidence, answerId=trace.get('answerId'),
+                coalesced=trace.get('coalesced', False), shed=trace.get('shed', False),
+                timings=trace.get('timings', {}))
+        log.verbose(candidates=trace.get('candidates'))
         
         # メトリクスの記録（フェーズ3で実装）
         # record_metrics(contact_id, processing_time, confidence, category)
         
-        return create_response(answer, confidence, category, processing_time)
+        # 生成のスロットリング・負荷制限の状況
+        limiter_counters = _generation_limiter.drain_counters()
+        if limiter_counters['attempts'] or limiter_counters['throttled'] or limiter_counters['shed']:
+            metrics.emit_generation_metrics(limiter_counters)
+        
+        # 回答の利用回数（音声の事前合成対象の選択に使用）と事前合成済み音声
+        prompt_uri = ''
+        answer_id = trace.get('answerId')
+        if answer_id:
+            metrics.emit_answer_usage(answer_id)
+            prompt_uri = get_audio_prompt_uri(answer_id, answer)
+        
+        return create_response(answer, confidence, category, processing_time, prompt_uri)
         
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
+        log.error('lambda_handler', e)
+        log.set(category="error")
         return create_response(
-            "申し訳ございません。現在システムが混雑しております。しばらくしてからおかけ直しください。",
+            BUSY_MESSAGE,
             confidence=0.0,
             category="error",
             processing_time=time.time() - start_time
         )
+    
+    finally:
+        log.emit()
 
-def get_answer_from_knowledge_base(question: str) -> tuple[str, float, str]:
+def process_question(question: str, trace: Optional[Dict[str, Any]] = None,
+                     deadline: Optional[float] = None, question_key: Optional[str] = None) -> tuple[str, float, str]:
     """
-    ナレッジベースから関連する回答を検索
+    質問に対する回答パイプライン（検索 → 必要に応じて生成）
     
     Args:
         question: ユーザーの質問
+        trace: 指定された場合、ステージ別処理時間・検索候補・校正用特徴量を記録する
+        deadline: 回答を返すべき時刻（epoch秒）。生成の待機はこの時刻までに限る
+        question_key: validate_inputで算出済みの正規化キー（省略時はquestionから算出）
     
     Returns:
         回答、信頼度、カテゴリのタプル
     """
+    timings = trace.setdefault('timings', {}) if trace is not None else {}
+    if question_key is None:
+        question_key = canonical_key(question)
+    
+    # 事前計算済みの完全一致テーブル（検索・生成を経由しない）
+    stage_start = time.time()
+    static_response = get_static_response(question, question_key)
+    timings['static'] = time.time() - stage_start
+    
+    if static_response is not None:
+        if trace is not None:
+            trace['candidates'] = [static_response['id']]
+            trace['answerId'] = static_response['id']
+        return static_response['answer'], 1.0, static_response['category']
+    
+    # 同一質問の同時リクエストは1回の検索・生成にまとめ、フォロワーはリーダーの結果を使用
+    coalesce_key = f"{get_knowledge_version() or ''}|{question_key}"
+    stage_start = time.time()
+    result, shared = _single_flight.do(
+        coalesce_key,
+        lambda: answer_with_retrieval(question, trace, deadline),
+        publish_if=lambda r: r['category'] not in NON_SHAREABLE_CATEGORIES,
+        deadline=deadline
+    )
+    
+    if shared:
+        timings['coalesced'] = time.time() - stage_start
+        if trace is not None:
+            trace['coalesced'] = True
+            # 検索候補・特徴量もリーダーのものを引き継ぐ（バッチ評価・信頼度校正で使用）
+            for field in ('answerId', 'candidates', 'features'):
+                if result.get(field) is not None:
+                    trace[field] = result[field]
+    
+    return result['answer'], result['confidence'], result['category']
+
+def answer_with_retrieval(question: str, trace: Optional[Dict[str, Any]] = None,
+                          deadline: Optional[float] = None) -> Dict[str, Any]:
+    """
+    検索し、校正済みの正答確率が閾値未満の場合のみBedrockで生成
+    生成は同時実行制限の範囲で行い、制限された場合は検索結果のみで回答する
+    
+    Args:
+        question: ユーザーの質問
+        trace: 指定された場合、ステージ別処理時間・検索候補・校正用特徴量を記録する
+        deadline: 回答を返すべき時刻（epoch秒）
+    
+    Returns:
+        回答・信頼度・カテゴリ・Q&A ID・検索候補・特徴量の辞書（他のリクエストと共有される）
+    """
+    trace = trace if trace is not None else {}
+    timings = trace.setdefault('timings', {})
+    
+    # ナレッジベースから回答を取得
+    stage_start = time.time()
+    answer, confidence, category = get_answer_from_knowledge_base(question, trace)
+    timings['retrieval'] = time.time() - stage_start
+    
+    if confidence < GENERATION_CONFIDENCE_THRESHOLD:
+        stage_start = time.time()
+        if _generation_limiter.acquire(deadline):
+            try:
+                # 検索結果のカテゴリの回答例を使用（該当なしの場合は各カテゴリの代表例）
+                generated = generate_answer_with_bedrock(question, category if answer else None)
+            finally:
+                _generation_limiter.release()
+        else:
+            logger.debug("Generation shed by concurrency limiter")
+            generated = ("", 0.0, "shed")
+        timings['generation'] = time.time() - stage_start
+        
+        if generated[2] in ('shed', 'generation_throttled'):
+            # 生成できない場合は検索結果（KBのみの回答）を優先し、なければ混雑応答
+            trace['shed'] = True
+            if answer:
+                category = generated[2]
+            else:
+                answer, confidence, category = BUSY_MESSAGE, 0.0, generated[2]
+        else:
+            answer, confidence, category = generated
+            trace.pop('answerId', None)
+    
+    return {
+        'answer': answer,
+        'confidence': confidence,
+        'category': category,
+        'answerId': trace.get('answerId'),
+        'candidates': trace.get('candidates'),
+        'features': trace.get('features')
+    }
+
+def get_static_response(question: str, question_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    kb_updateが事前計算した完全一致テーブルから回答を取得
+    
+    Args:
+        question: ユーザーの質問
+        question_key: 正規化キー（省略時はquestionから算出）
+    
+    Returns:
+        回答（id, answer, category）。該当しない場合はNone
+    """
     try:
-        # Knowledge Base IDが設定されていない場合（フェーズ1）
-        if not KNOWLEDGE_BASE_ID or KNOWLEDGE_BASE_ID == 'debug-placeholder':
-            logger.info("Knowledge Base not configured, using fallback")
-            return get_answer_from_s3(question)
+        table = load_static_responses()
+        if table is None:
+            return None
+        
+        response = lookup_static_response(table, question, question_key)
+        if response is not None:
+            logger.debug(f"Static response hit: {response['id']}")
+        return response
         
-        # Bedrock Knowledge Baseからの検索（フェーズ2で完全実装）
+    except Exception as e:
+        structured_logger.log_error('static_response_lookup', e, escalate=False)
+        return None
+
+def get_answer_from_knowledge_base(question: str, trace: Optional[Dict[str, Any]] = None) -> tuple[str, float, str]:
+    """
+    Knowledge Base・ローカルベクトル検索・キーワードマッチングの候補を
+    Reciprocal Rank Fusionで統合して回答を選択
+    
+    Args:
+        question: ユーザーの質問
+        trace: 指定された場合、検索候補のQ&A IDと校正用特徴量を記録する
+    
+    Returns:
+        回答、信頼度（校正済みの正答確率）、カテゴリのタプル
+    """
+    # ネットワークを伴う検索（KB検索と質問文の埋め込み）は並行して実行
+    kb_future = None
+    if KNOWLEDGE_BASE_ID and KNOWLEDGE_BASE_ID != 'debug-placeholder':
+        # エラーを呼び出しのログレコードに記録できるようコンテキストを引き継ぐ
+        kb_future = _retrieval_executor.submit(contextvars.copy_context().run, retrieve_kb_candidates, question)
+    else:
+        logger.debug("Knowledge Base not configured, using local retrieval only")
+    
+    sources = {
+        'kb': kb_future.result() if kb_future else None,
+        'vector': retrieve_vector_candidates(question),
+        'lexical': retrieve_lexical_candidates(question)
+    }
+    
+    candidates: Dict[str, Dict[str, Any]] = {}
+    rankings: Dict[str, List[str]] = {}
+    scores: Dict[str, Dict[str, float]] = {}
+    # 未設定・障害で検索できなかったソース（None）は検索したソースに含めない（特徴量の正規化に使用）
+    consulted = [source for source, results in sources.items() if results is not None]
+    for source in consulted:
+        rankings[source] = [c['id'] for c in sources[source]]
+        scores[source] = {c['id']: c['score'] for c in sources[source]}
+        for c in sources[source]:
+            candidates.setdefault(c['id'], c)
+    
+    fused = reciprocal_rank_fusion(rankings)
+    
+    if trace is not None:
+        trace['candidates'] = [candidate_id for _, candidate_id in fused]
+    
+    if not fused:
+        return "", 0.0, "not_found"
+    
+    top_id = fused[0][1]
+    features = extract_features(top_id, fused, rankings, scores)
+    confidence = load_calibrator().probability(features)
+    
+    if trace is not None:
+        trace['features'] = features
+        if not top_id.startswith('kb:'):
+            trace['answerId'] = top_id
+    
+    top = candidates[top_id]
+    logger.debug(f"Selected {top_id} with calibrated confidence: {confidence:.3f}")
+    return top['answer'], confidence, top['category']
+
+def retrieve_kb_candidates(question: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Bedrock Knowledge Baseから候補を検索
+    
+    Args:
+        question: ユーザーの質問
+    
+    Returns:
+        候補（id, score, answer, category）のリスト（順位順）。検索できなかった場合はNone
+    """
+    try:
         response = bedrock_agent_runtime.retrieve(
             knowledgeBaseId=KNOWLEDGE_BASE_ID,
             retrievalQuery={
@@ -105,144 +396,423 @@ def get_answer_from_knowledge_base(question: str) -> tuple[str, float, str]:
             },
             retrievalConfiguration={
                 'vectorSearchConfiguration': {
-                    'numberOfResults': 3
+                    'numberOfResults': RETRIEVAL_CANDIDATES
                 }
             }
         )
         
-        # 最も関連性の高い結果を取得
-        if response['retrievalResults']:
-            result = response['retrievalResults'][0]
-            answer = result['content']['text']
-            confidence = result['score']
-            category = 'knowledge_base'
-            
-            logger.info(f"Found answer in knowledge base with confidence: {confidence}")
-            return answer, confidence, category
-            
+        qa_by_id = get_qa_by_id()
+        candidates = []
+        for rank, result in enumerate(response['retrievalResults']):
+            text = result['content']['text']
+            qa_id = match_qa_id(text, result.get('metadata'))
+            qa = qa_by_id.get(qa_id)
+            candidates.append({
+                'id': qa_id or f'kb:{rank}',
+                'score': result['score'],
+                'answer': qa['answer'] if qa else text,
+                'category': qa['category'] if qa else 'knowledge_base'
+            })
+        
+        return candidates
+        
     except ClientError as e:
-        logger.error(f"Error accessing knowledge base: {e}")
+        structured_logger.log_error('knowledge_base_search', e, escalate=False)
     except Exception as e:
-        logger.error(f"Unexpected error in knowledge base search: {e}")
+        structured_logger.log_error('knowledge_base_search', e, escalate=False)
     
-    return "", 0.0, "not_found"
+    return None
 
-def get_answer_from_s3(question: str) -> tuple[str, float, str]:
+def retrieve_vector_candidates(question: str) -> Optional[List[Dict[str, Any]]]:
     """
-    S3から直接Q&Aデータを読み込んで回答を検索（フォールバック）
+    kb_updateが事前計算した埋め込み行列に対してインプロセスでベクトル検索
     
     Args:
         question: ユーザーの質問
     
     Returns:
-        回答、信頼度、カテゴリのタプル
+        候補（id, score, answer, category）のリスト（順位順）。検索できなかった場合はNone
+    """
+    try:
+        index = load_vector_index()
+        if index is None:
+            return None
+        
+        qa_by_id = get_qa_by_id()
+        return [
+            {
+                'id': qa_id,
+                'score': max(score, 0.0),
+                'answer': qa_by_id[qa_id]['answer'],
+                'category': qa_by_id[qa_id]['category']
+            }
+            for score, qa_id in index.search(list(embed_question(question)), k=RETRIEVAL_CANDIDATES)
+            if score >= VECTOR_MIN_SCORE and qa_id in qa_by_id
+        ]
+        
+    except Exception as e:
+        structured_logger.log_error('vector_search', e, escalate=False)
+        return None
+
+def retrieve_lexical_candidates(question: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    S3のQ&Aデータに対するキーワードマッチング
+    
+    Args:
+        question: ユーザーの質問
+    
+    Returns:
+        候補（id, score, answer, category）のリスト（順位順）。検索できなかった場合はNone
+    """
+    try:
+        if not KNOWLEDGE_BUCKET:
+            return None
+        
+        return [
+            {
+                'id': qa.get('id'),
+                'score': min(score / 3.0, 1.0),  # 正規化
+                'answer': qa['answer'],
+                'category': qa['category']
+            }
+            for score, qa in rank_qa_entries(question, load_qa_data())[:RETRIEVAL_CANDIDATES]
+        ]
+        
+    except Exception as e:
+        structured_logger.log_error('lexical_search', e, escalate=False)
+        return None
+
+@functools.lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def embed_question(question: str) -> tuple:
+    """
+    質問文の埋め込み（同一の書き起こしはコンテナ内でキャッシュ）
+    
+    Args:
+        question: ユーザーの質問
+    
+    Returns:
+        埋め込みベクトル
+    """
+    return tuple(embed_with_bedrock(bedrock_runtime, EMBEDDING_MODEL_ID, question, EMBEDDING_DIMENSIONS))
+
+def load_vector_index() -> Optional[VectorIndex]:
+    """
+    埋め込み行列を読み込む（ナレッジバージョン単位でキャッシュ）
+    
+    Returns:
+        ベクトルインデックス（未作成の場合はNone）
+    """
+    if not KNOWLEDGE_BUCKET:
+        return None
+    
+    get_knowledge_version()
+    
+    if _knowledge_cache['vector_index'] is None:
+        try:
+            response = s3.get_object(Bucket=KNOWLEDGE_BUCKET, Key=VECTOR_INDEX_KEY)
+            index = VectorIndex.from_bytes(response['Body'].read())
+            model_id = response.get('Metadata', {}).get('model-id')
+            if model_id and model_id != EMBEDDING_MODEL_ID:
+                # 質問の埋め込みと異なるモデルのベクトルは比較できない
+                logger.error(f"Vector index built with {model_id}, expected {EMBEDDING_MODEL_ID}")
+                index = False
+            _knowledge_cache['vector_index'] = index
+        except ClientError as e:
+            logger.info(f"Vector index unavailable: {e}")
+            # 次のバージョン変更まで再取得しない
+            _knowledge_cache['vector_index'] = False
+    
+    return _knowledge_cache['vector_index'] or None
+
+def load_static_responses() -> Optional[Dict[str, Any]]:
+    """
+    完全一致テーブルを読み込む（ナレッジバージョン単位でキャッシュ）
+    
+    Returns:
+        完全一致テーブル（未作成の場合はNone）
+    """
+    if not KNOWLEDGE_BUCKET:
+        return None
+    
+    get_knowledge_version()
+    
+    if _knowledge_cache['static_responses'] is None:
+        try:
+            response = s3.get_object(Bucket=KNOWLEDGE_BUCKET, Key=STATIC_RESPONSES_KEY)
+            _knowledge_cache['static_responses'] = json.loads(response['Body'].read().decode('utf-8'))
+        except ClientError as e:
+            logger.info(f"Static response table unavailable: {e}")
+            # 次のバージョン変更まで再取得しない
+            _knowledge_cache['static_responses'] = False
+    
+    return _knowledge_cache['static_responses'] or None
+
+def get_audio_prompt_uri(answer_id: str, answer: str) -> str:
+    """
+    事前合成済みの回答音声のS3オブジェクトURLを取得
+    
+    Args:
+        answer_id: Q&A ID
+        answer: 回答テキスト
+    
+    Returns:
+        Connectのプロンプトとして再生するS3オブジェクトURL（該当しない場合は空文字）
     """
     try:
         if not KNOWLEDGE_BUCKET:
-            return "", 0.0, "not_configured"
+            return ''
+        
+        get_knowledge_version()
+        
+        if _knowledge_cache['audio_prompts'] is None:
+            try:
+                response = s3.get_object(Bucket=KNOWLEDGE_BUCKET, Key=AUDIO_MANIFEST_KEY)
+                _knowledge_cache['audio_prompts'] = json.loads(response['Body'].read().decode('utf-8'))
+            except ClientError as e:
+                logger.info(f"Audio prompt manifest unavailable: {e}")
+                # 次のバージョン変更まで再取得しない
+                _knowledge_cache['audio_prompts'] = False
         
-        # S3からQ&Aデータを読み込み
+        manifest = _knowledge_cache['audio_prompts']
+        key = find_prompt(manifest, answer_id, answer) if manifest else None
+        if not key:
+            return ''
+        # ConnectのS3プロンプト再生はs3://形式ではなくHTTPSのオブジェクトURLを要求する
+        region = os.environ.get('AWS_REGION') or s3.meta.region_name
+        return f'https://{KNOWLEDGE_BUCKET}.s3.{region}.amazonaws.com/{urllib.parse.quote(key)}'
+        
+    except Exception as e:
+        structured_logger.log_error('audio_prompt_lookup', e, escalate=False)
+        return ''
+
+def load_calibrator() -> Calibrator:
+    """
+    信頼度の校正パラメータを読み込む（ナレッジバージョン単位でキャッシュ）
+    未学習の場合は既定のパラメータを使用する
+    
+    Returns:
+        校正器
+    """
+    get_knowledge_version()
+    
+    if _knowledge_cache['calibrator'] is None:
+        parameters = None
+        if KNOWLEDGE_BUCKET:
+            try:
+                response = s3.get_object(Bucket=KNOWLEDGE_BUCKET, Key=CALIBRATION_KEY)
+                parameters = json.loads(response['Body'].read().decode('utf-8'))
+            except ClientError as e:
+                logger.info(f"Calibration parameters unavailable, using defaults: {e}")
+        _knowledge_cache['calibrator'] = Calibrator(parameters)
+    
+    return _knowledge_cache['calibrator']
+
+def rank_qa_entries(question: str, qa_data: List[Dict[str, Any]]) -> List[tuple[float, Dict[str, Any]]]:
+    """
+    簡易的なキーワードマッチングでQ&Aをスコア順に並べる
+    
+    Args:
+        question: ユーザーの質問
+        qa_data: Q&Aデータ
+    
+    Returns:
+        スコアが0より大きい（スコア, Q&A）のリスト（降順）
+    """
+    question_lower = question.lower()
+    ranked = []
+    
+    for qa in qa_data:
+        score = 0.0
+        
+        # キーワードマッチング
+        for keyword in qa.get('keywords', []):
+            if keyword.lower() in question_lower:
+                score += 1.0
+        
+        # 質問文の類似度（簡易版）
+        if qa['question'].lower() in question_lower:
+            score += 2.0
+        
+        if score > 0:
+            ranked.append((score, qa))
+    
+    # 同点の場合はデータ内の順序を維持
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return ranked
+
+def match_qa_id(text: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Knowledge Baseの検索結果に対応するQ&A IDを特定
+    
+    Args:
+        text: 検索結果のチャンク本文
+        metadata: 検索結果のメタデータ
+    
+    Returns:
+        Q&A ID（特定できない場合はNone）
+    """
+    if metadata and metadata.get('id'):
+        return metadata['id']
+    
+    if not KNOWLEDGE_BUCKET:
+        return None
+    
+    for qa in load_qa_data():
+        if qa['answer'] in text:
+            return qa.get('id')
+    
+    return None
+
+def get_knowledge_version() -> Optional[str]:
+    """
+    ナレッジバージョンを確認し、変更があればキャッシュを破棄
+    S3への確認はKNOWLEDGE_VERSION_CHECK_INTERVAL秒に1回のHEADリクエストのみ
+    
+    Returns:
+        現在のナレッジバージョン（マーカーのETag）
+    """
+    now = time.time()
+    if now - _knowledge_cache['checked_at'] < KNOWLEDGE_VERSION_CHECK_INTERVAL:
+        return _knowledge_cache['version']
+    
+    _knowledge_cache['checked_at'] = now
+    
+    if not KNOWLEDGE_BUCKET:
+        return _knowledge_cache['version']
+    
+    try:
+        response = s3.head_object(Bucket=KNOWLEDGE_BUCKET, Key=KNOWLEDGE_VERSION_KEY)
+        version = response['ETag']
+    except ClientError as e:
+        # マーカー未作成の場合は現在のキャッシュを維持
+        logger.debug(f"Knowledge version marker unavailable: {e}")
+        return _knowledge_cache['version']
+    
+    if version != _knowledge_cache['version']:
+        if _knowledge_cache['version'] is not None:
+            logger.info(f"Knowledge version changed to {version}, invalidating caches")
+        for key in list(_knowledge_cache.keys()):
+            if key not in ('version', 'checked_at'):
+                _knowledge_cache[key] = None
+        _knowledge_cache['version'] = version
+    
+    return version
+
+def load_qa_data() -> list:
+    """
+    S3のQ&Aデータを読み込む（ナレッジバージョン単位でキャッシュ）
+    
+    Returns:
+        Q&Aデータのリスト
+    """
+    get_knowledge_version()
+    
+    if _knowledge_cache['qa_data'] is None:
         response = s3.get_object(
             Bucket=KNOWLEDGE_BUCKET,
             Key='qa-data/qa-knowledge.json'
         )
-        qa_data = json.loads(response['Body'].read().decode('utf-8'))
-        
-        # 簡易的なキーワードマッチング
-        question_lower = question.lower()
-        best_match = None
-        best_score = 0.0
-        
-        for qa in qa_data:
-            score = 0.0
-            
-            # キーワードマッチング
-            for keyword in qa.get('keywords', []):
-                if keyword.lower() in question_lower:
-                    score += 1.0
-            
-            # 質問文の類似度（簡易版）
-            if qa['question'].lower() in question_lower:
-                score += 2.0
-            
-            if score > best_score:
-                best_score = score
-                best_match = qa
-        
-        if best_match and best_score > 0:
-            confidence = min(best_score / 3.0, 1.0)  # 正規化
-            return best_match['answer'], confidence, best_match['category']
-        
-    except Exception as e:
-        logger.error(f"Error reading from S3: {e}")
+        _knowledge_cache['qa_data'] = json.loads(response['Body'].read().decode('utf-8'))
+    
+    return _knowledge_cache['qa_data']
+
+def get_qa_by_id() -> Dict[str, Dict[str, Any]]:
+    """
+    Q&A IDからQ&Aエントリへの対応表（ナレッジバージョン単位でキャッシュ）
+    """
+    if not KNOWLEDGE_BUCKET:
+        return {}
+    
+    qa_data = load_qa_data()
+    
+    if _knowledge_cache['qa_by_id'] is None:
+        _knowledge_cache['qa_by_id'] = {qa.get('id'): qa for qa in qa_data}
+    
+    return _knowledge_cache['qa_by_id']
+
+def load_prompt_library() -> PromptLibrary:
+    """
+    生成プロンプトの回答例（ナレッジバージョン単位でキャッシュ）
+    Q&Aデータを読み込めない場合は回答例なしで生成する
+    """
+    get_knowledge_version()
+    
+    if _knowledge_cache['prompt_library'] is None:
+        qa_data = []
+        if KNOWLEDGE_BUCKET:
+            try:
+                qa_data = load_qa_data()
+            except ClientError as e:
+                logger.info(f"Q&A data unavailable for prompt examples: {e}")
+        min_tokens = prompt_cache_min_tokens(BEDROCK_MODEL_ID) if PROMPT_CACHE_PADDING else None
+        _knowledge_cache['prompt_library'] = PromptLibrary(qa_data, PROMPT_EXAMPLE_TOKEN_BUDGET, min_tokens)
     
-    return "", 0.0, "not_found"
+    return _knowledge_cache['prompt_library']
 
-def generate_answer_with_bedrock(question: str) -> tuple[str, float, str]:
+def generate_answer_with_bedrock(question: str, category: Optional[str] = None) -> tuple[str, float, str]:
     """
     Bedrock LLMを使用して回答を生成
     
     Args:
         question: ユーザーの質問
+        category: 検索結果のカテゴリ（プロンプトの回答例の選択に使用）
     
     Returns:
         回答、信頼度、カテゴリのタプル
     """
     try:
-        prompt = f"""あなたはレジシステムのサポート担当者です。
-以下の質問に対して、丁寧で簡潔な回答を提供してください。
-技術的な詳細は避け、実際の操作手順を中心に説明してください。
-
-質問: {question}
-
-回答:"""
+        system_prompt = load_prompt_library().system_prompt(category)
         
         # Bedrockモデルの呼び出し
-        if BEDROCK_MODEL_ID.startswith('claude'):
-            response = bedrock_runtime.invoke_model(
-                modelId=BEDROCK_MODEL_ID,
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 500,
-                    "temperature": 0.7,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                })
-            )
-        else:
-            # Amazon Nova等の他のモデル用
-            response = bedrock_runtime.invoke_model(
-                modelId=BEDROCK_MODEL_ID,
-                body=json.dumps({
-                    "prompt": prompt,
-                    "max_tokens": 500,
-                    "temperature": 0.7
-                })
-            )
+        invoke_start = time.time()
+        response = bedrock_runtime.invoke_model(
+            modelId=BEDROCK_MODEL_ID,
+            body=json.dumps(build_request_body(BEDROCK_MODEL_ID, system_prompt, question))
+        )
         
+        _generation_limiter.on_success(time.time() - invoke_start)
         response_body = json.loads(response['body'].read())
         
-        if BEDROCK_MODEL_ID.startswith('claude'):
+        if is_claude_model(BEDROCK_MODEL_ID):
             answer = response_body['content'][0]['text']
+            # プロンプトキャッシュの効果（キャッシュから読んだ入力トークン数）を記録
+            usage = response_body.get('usage', {})
+            record = structured_logger.current()
+            if record is not None:
+                record.set(
+                    inputTokens=usage.get('input_tokens'),
+                    cacheReadTokens=usage.get('cache_read_input_tokens', 0),
+                    cacheWriteTokens=usage.get('cache_creation_input_tokens', 0)
+                )
         else:
             answer = response_body['completion']
         
-        logger.info(f"Generated answer using {BEDROCK_MODEL_ID}")
+        logger.debug(f"Generated answer using {BEDROCK_MODEL_ID}")
         return answer, 0.7, "bedrock_generated"
         
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'ThrottlingException':
+            _generation_limiter.on_throttle()
+            logger.debug(f"Bedrock throttled, concurrency limit reduced to {_generation_limiter.limit:.2f}")
+            category = "generation_throttled"
+        else:
+            structured_logger.log_error('bedrock_generation', e, escalate=False)
+            category = "generation_error"
+        return (
+            "申し訳ございませんが、該当する情報が見つかりませんでした。技術サポートまでお問い合わせください。",
+            0.3,
+            category
+        )
     except Exception as e:
-        logger.error(f"Error generating answer with Bedrock: {e}")
+        structured_logger.log_error('bedrock_generation', e, escalate=False)
         return (
             "申し訳ございませんが、該当する情報が見つかりませんでした。技術サポートまでお問い合わせください。",
             0.3,
             "generation_error"
         )
 
-def create_response(response: str, confidence: float, category: str, processing_time: float) -> Dict[str, Any]:
+def create_response(response: str, confidence: float, category: str, processing_time: float,
+                    prompt_uri: str = '') -> Dict[str, Any]:
     """
     Connect Contact Flow用のレスポンスを作成
     
@@ -251,6 +821,8 @@ def create_response(response: str, confidence: float, category: str, processing_
         confidence: 信頼度スコア
         category: 回答カテゴリ
         processing_time: 処理時間
+        prompt_uri: 事前合成済み音声のS3 URI（Contact Flowはこれがあれば音声を再生し、
+            なければresponseを読み上げる）
     
     Returns:
         フォーマットされたレスポンス
@@ -259,5 +831,6 @@ def create_response(response: str, confidence: float, category: str, processing_
         'response': response,
         'confidence': confidence,
         'category': category,
-        'processingTime': processing_time
+        'processingTime': processing_time,
+        'promptUri': prompt_uri
     }
\ No newline at end of file
@@ -0,0 +1,139 @@
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional, Callable
+
+logger = logging.getLogger()
+
+# Ingestionジョブの終了状態
+TERMINAL_STATUSES = {'COMPLETE', 'FAILED', 'STOPPED'}
+
+# ナレッジバージョンマーカー
+# 注：qa-data/ はKnowledge Baseのデータソース対象のため、別プレフィックスに配置する
+KNOWLEDGE_VERSION_KEY = 'knowledge-artifacts/knowledge-version.json'
+
+# 統計情報として記録する項目（get_ingestion_jobのstatistics）
+STATISTIC_FIELDS = {
+    'numberOfDocumentsScanned': 'documentsScanned',
+    'numberOfNewDocumentsIndexed': 'newDocumentsIndexed',
+    'numberOfModifiedDocumentsIndexed': 'modifiedDocumentsIndexed',
+    'numberOfDocumentsDeleted': 'documentsDeleted',
+    'numberOfDocumentsFailed': 'documentsFailed'
+}
+
+class IngestionTracker:
+    """
+    Bedrock Knowledge BaseのIngestionジョブを終了状態まで追跡し、
+    完了時にナレッジバージョンマーカーを公開する
+    """
+    def __init__(self, bedrock_agent_client, s3_client, knowledge_base_id: str, bucket: str,
+                 poll_interval: float = 10.0,
+                 sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.time):
+        self.bedrock_agent = bedrock_agent_client
+        self.s3 = s3_client
+        self.knowledge_base_id = knowledge_base_id
+        self.bucket = bucket
+        self.poll_interval = poll_interval
+        self.sleep = sleep
+        self.clock = clock
+
+    def get_job(self, job_id: str, data_source_id: str) -> Dict[str, Any]:
+        """ジョブの現在状態を取得"""
+        response = self.bedrock_agent.get_ingestion_job(
+            knowledgeBaseId=self.knowledge_base_id,
+            dataSourceId=data_source_id,
+            ingestionJobId=job_id
+        )
+        return response['ingestionJob']
+
+    def wait_for_completion(self, job_id: str, data_source_id: str, timeout: float) -> Dict[str, Any]:
+        """
+        ジョブが終了状態になるまでポーリング
+
+        Args:
+            job_id: IngestionジョブID
+            data_source_id: データソースID
+            timeout: 待機の上限（秒）。超過した場合は途中経過を返す
+
+        Returns:
+            ジョブの要約（summarize_jobの結果）
+        """
+        deadline = self.clock() + timeout
+
+        while True:
+            job = self.get_job(job_id, data_source_id)
+            summary = self.summarize_job(job)
+
+            if summary['terminal']:
+                logger.info(f"Ingestion job {job_id} finished with status: {summary['status']}")
+                return summary
+
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                logger.warning(f"Ingestion job {job_id} still {summary['status']} at tracking deadline")
+                return summary
+
+            self.sleep(min(self.poll_interval, remaining))
+
+    def summarize_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """get_ingestion_jobの結果を履歴記録用に要約"""
+        status = job.get('status', 'UNKNOWN')
+        statistics = job.get('statistics', {})
+        started_at = job.get('startedAt')
+        updated_at = job.get('updatedAt')
+
+        duration = None
+        if isinstance(started_at, datetime) and isinstance(updated_at, datetime):
+            duration = (updated_at - started_at).total_seconds()
+
+        summary = {
+            'jobId': job.get('ingestionJobId'),
+            'dataSourceId': job.get('dataSourceId'),
+            'status': status,
+            'terminal': status in TERMINAL_STATUSES,
+            'durationSeconds': duration,
+            'startedAt': started_at.isoformat() if isinstance(started_at, datetime) else started_at,
+            'updatedAt': updated_at.isoformat() if isinstance(updated_at, datetime) else updated_at,
+            'statistics': {
+                name: statistics.get(field, 0) for field, name in STATISTIC_FIELDS.items()
+            }
+        }
+
+        if job.get('failureReasons'):
+            summary['failureReasons'] = job['failureReasons']
+
+        return summary
+
+    def publish_knowledge_version(self, source: str, details: Optional[Dict[str, Any]] = None) -> str:
+        """
+        ナレッジバージョンマーカーを更新
+        実行時キャッシュはこのオブジェクトのETagを監視して無効化を判断する
+
+        Args:
+            source: 更新元（ジョブIDやイベント種別）
+            details: マーカーに含める付加情報
+
+        Returns:
+            公開したバージョン
+        """
+        published_at = datetime.utcnow().isoformat()
+        version = f"{published_at}/{source}"
+
+        marker = {
+            'version': version,
+            'publishedAt': published_at,
+            'source': source,
+            'details': details or {}
+        }
+
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=KNOWLEDGE_VERSION_KEY,
+            Body=json.dumps(marker, ensure_ascii=False, default=str),
+            ContentType='application/json'
+        )
+
+        logger.info(f"Knowledge version published: {version}")
+        return version
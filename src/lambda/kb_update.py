@@ -5,17 +5,43 @@ import os
 from datetime import datetime
 from typing import Dict, Any, List
 
+from audio_prompts import AudioPromptCache, PollySynthesizer, select_popular_answers
+from backup_manager import BackupManager
+from ingestion_tracker import IngestionTracker
+from quality_metrics import QualityMetrics
+from static_responses import STATIC_RESPONSES_KEY, build_static_table
+from vector_index import VectorIndex, VECTOR_INDEX_KEY, embed_with_bedrock
+import structured_logger
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # AWSクライアント
 s3 = boto3.client('s3')
 bedrock_agent = boto3.client('bedrock-agent')
+bedrock_runtime = boto3.client('bedrock-runtime')
+polly = boto3.client('polly')
+lambda_client = boto3.client('lambda')
 
 # 環境変数
 KNOWLEDGE_BASE_ID = os.environ.get('KNOWLEDGE_BASE_ID')
 S3_BUCKET = os.environ.get('S3_BUCKET')
 ENVIRONMENT = os.environ.get('ENVIRONMENT', 'unknown')
+BACKUP_RETENTION_COUNT = int(os.environ.get('BACKUP_RETENTION_COUNT', '30'))
+BACKUP_RETENTION_DAYS = int(os.environ.get('BACKUP_RETENTION_DAYS', '90'))
+EMBEDDING_MODEL_ID = os.environ.get('EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v2:0')
+EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', '256'))
+VECTOR_INDEX_DTYPE = os.environ.get('VECTOR_INDEX_DTYPE', 'float16')
+# 回答音声の事前合成
+AUDIO_PRERENDER_TOP_N = int(os.environ.get('AUDIO_PRERENDER_TOP_N', '20'))
+AUDIO_POPULARITY_DAYS = int(os.environ.get('AUDIO_POPULARITY_DAYS', '7'))
+AUDIO_VOICE_ID = os.environ.get('AUDIO_VOICE_ID', 'Takumi')
+AUDIO_ENGINE = os.environ.get('AUDIO_ENGINE', 'neural')
+INGESTION_POLL_INTERVAL = float(os.environ.get('INGESTION_POLL_INTERVAL', '10'))
+# Lambdaタイムアウト前に追跡を打ち切るための余裕（秒）
+INGESTION_TRACKING_MARGIN = float(os.environ.get('INGESTION_TRACKING_MARGIN', '15'))
+# 追跡を自身の非同期呼び出しで再開する最大回数（ジョブが終了しない場合の打ち切り）
+INGESTION_MAX_RESUMES = int(os.environ.get('INGESTION_MAX_RESUMES', '24'))
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -29,25 +55,46 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     Returns:
         処理結果
     """
+    log = structured_logger.begin(
+        'kb_update',
+        environment=ENVIRONMENT,
+        trigger=event.get('source') or event.get('action') or 'scheduled'
+    )
+    log.verbose(event=event)
+    
     try:
-        logger.info(f"Knowledge base update started for environment: {ENVIRONMENT}")
-        logger.info(f"Event: {json.dumps(event)}")
-        
         # S3からの更新
         if event.get('source') == 'aws.s3':
             # S3イベントからの自動更新
             bucket = event['detail']['bucket']['name']
             key = event['detail']['object']['key']
-            return handle_s3_update(bucket, key)
+            return handle_s3_update(bucket, key, context)
+        
+        # 実行中のIngestionジョブの追跡再開
+        if event.get('action') == 'track_ingestion':
+            return handle_ingestion_tracking(
+                event['jobId'], event['dataSourceId'], context, event.get('resumeCount', 0)
+            )
+        
+        # バックアップからの復元
+        if event.get('action') == 'restore_backup':
+            return handle_restore(event['version'])
+        
+        # 回答音声の事前合成のみ実行
+        if event.get('action') == 'prerender_audio':
+            return handle_audio_prerender()
         
         # 定期更新またはマニュアル実行
-        return handle_scheduled_update()
+        return handle_scheduled_update(context)
         
     except Exception as e:
-        logger.error(f"Error in knowledge base update: {str(e)}")
+        log.error('lambda_handler', e)
         raise
+    
+    finally:
+        log.emit()
 
-def handle_scheduled_update() -> Dict[str, Any]:
+def handle_scheduled_update(context: Any = None) -> Dict[str, Any]:
     """
     定期更新処理
     """
@@ -67,11 +114,17 @@ def handle_scheduled_update() -> Dict[str, Any]:
                 }
             }
         
+        # 実行時に使用する事前計算データを更新
+        build_runtime_artifacts()
+        
         # ナレッジベースの同期
         if KNOWLEDGE_BASE_ID and KNOWLEDGE_BASE_ID != 'debug-placeholder':
             sync_result = sync_knowledge_base()
             
-            # 同期結果の記録
+            # ジョブ完了まで追跡し、同期結果を記録
+            sync_result['ingestion'] = track_ingestion_job(
+                sync_result['jobId'], sync_result['dataSourceId'], context
+            )
             record_update_history(sync_result)
             
             return {
@@ -83,6 +136,8 @@ def handle_scheduled_update() -> Dict[str, Any]:
             }
         else:
             logger.info("Knowledge base ID not configured, skipping sync")
+            # S3フォールバック利用時も実行時キャッシュを無効化する
+            create_tracker().publish_knowledge_version('scheduled_update', validation_result.get('stats'))
             return {
                 'statusCode': 200,
                 'body': {
@@ -95,7 +150,7 @@ def handle_scheduled_update() -> Dict[str, Any]:
         logger.error(f"Error in scheduled update: {str(e)}")
         raise
 
-def handle_s3_update(bucket: str, key: str) -> Dict[str, Any]:
+def handle_s3_update(bucket: str, key: str, context: Any = None) -> Dict[str, Any]:
     """
     S3イベントによる更新処理
     """
@@ -121,17 +176,27 @@ def handle_s3_update(bucket: str, key: str) -> Dict[str, Any]:
                 }
             }
         
+        if key == 'qa-data/qa-knowledge.json':
+            build_runtime_artifacts()
+        
         # 即座に同期を実行
         if KNOWLEDGE_BASE_ID and KNOWLEDGE_BASE_ID != 'debug-placeholder':
             sync_result = trigger_ingestion_job()
+            sync_result['ingestion'] = track_ingestion_job(
+                sync_result['jobId'], sync_result['dataSourceId'], context
+            )
+            record_update_history(sync_result, update_type='s3_update')
             return {
                 'statusCode': 200,
                 'body': {
-                    'message': 'Ingestion job started',
-                    'jobId': sync_result.get('ingestionJobId')
+                    'message': 'Ingestion job tracked',
+                    'jobId': sync_result['jobId'],
+                    'ingestion': sync_result['ingestion']
                 }
             }
         
+        create_tracker().publish_knowledge_version(f's3_update:{key}')
+        
         return {
             'statusCode': 200,
             'body': {'message': 'File validated successfully'}
@@ -141,29 +206,54 @@ def handle_s3_update(bucket: str, key: str) -> Dict[str, Any]:
         logger.error(f"Error handling S3 update: {str(e)}")
         raise
 
-def backup_current_data():
+def create_backup_manager() -> BackupManager:
+    """
+    バックアップ管理を作成
+    """
+    return BackupManager(
+        s3,
+        S3_BUCKET,
+        retention_count=BACKUP_RETENTION_COUNT,
+        retention_days=BACKUP_RETENTION_DAYS
+    )
+
+def backup_current_data() -> Dict[str, Any]:
     """
     現在のデータをバックアップ
+    内容が前回から変わっていない場合はコピーを省略する
     """
     try:
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        
-        # メインのQ&Aデータをバックアップ
-        copy_source = {'Bucket': S3_BUCKET, 'Key': 'qa-data/qa-knowledge.json'}
-        backup_key = f'qa-data/backup/{timestamp}/qa-knowledge.json'
-        
-        s3.copy_object(
-            CopySource=copy_source,
-            Bucket=S3_BUCKET,
-            Key=backup_key
-        )
-        
-        logger.info(f"Backup created: {backup_key}")
+        return create_backup_manager().backup()
         
     except Exception as e:
         logger.error(f"Backup failed: {str(e)}")
         raise
 
+def handle_restore(version: Any) -> Dict[str, Any]:
+    """
+    指定バージョンのバックアップを復元
+    復元後のS3イベントで通常の更新処理が実行される
+    """
+    try:
+        result = create_backup_manager().restore(version)
+        return {
+            'statusCode': 200,
+            'body': {
+                'message': 'Backup restored',
+                'details': result
+            }
+        }
+        
+    except ValueError as e:
+        logger.error(f"Restore failed: {str(e)}")
+        return {
+            'statusCode': 404,
+            'body': {'message': str(e)}
+        }
+    except Exception as e:
+        logger.error(f"Restore failed: {str(e)}")
+        raise
+
 def validate_knowledge_data() -> Dict[str, Any]:
     """
     ナレッジデータの検証
@@ -188,6 +278,8 @@ def validate_knowledge_data() -> Dict[str, Any]:
             # データ型チェック
             if 'keywords' in item and not isinstance(item['keywords'], list):
                 errors.append(f"Item {idx}: 'keywords' must be a list")
+            if 'variants' in item and not isinstance(item['variants'], list):
+                errors.append(f"Item {idx}: 'variants' must be a list")
             
             # 文字数チェック
             if 'answer' in item and len(item['answer']) > 2000:
@@ -250,6 +342,128 @@ def validate_specific_file(bucket: str, key: str) -> Dict[str, Any]:
             'errors': [f'Error reading file: {str(e)}']
         }
 
+def build_runtime_artifacts() -> Dict[str, Any]:
+    """
+    helpdesk_processorが実行時に使用する事前計算データを更新
+    """
+    try:
+        response = s3.get_object(Bucket=S3_BUCKET, Key='qa-data/qa-knowledge.json')
+        qa_data = json.loads(response['Body'].read().decode('utf-8'))
+    except Exception as e:
+        logger.error(f"Failed to load Q&A data for runtime artifacts: {str(e)}")
+        return {'error': str(e)}
+    
+    return {
+        'static_responses': build_static_responses(qa_data),
+        'vector_index': build_vector_index(qa_data),
+        'audio_prompts': prerender_audio_prompts(qa_data)
+    }
+
+def prerender_audio_prompts(qa_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    利用回数の多い回答の音声を事前合成してS3に保存
+    Contact Flowは事前合成済みの音声があればTTSを経由せずに再生する
+    """
+    try:
+        usage = QualityMetrics().get_answer_usage([qa['id'] for qa in qa_data], days=AUDIO_POPULARITY_DAYS)
+        answer_ids = select_popular_answers(usage, AUDIO_PRERENDER_TOP_N)
+        
+        cache = AudioPromptCache(s3, S3_BUCKET, PollySynthesizer(polly, AUDIO_VOICE_ID, AUDIO_ENGINE))
+        manifest = cache.prerender(qa_data, answer_ids)
+        
+        return {'prompts': len(manifest['prompts']), 'retired': len(manifest['retired']), 'selected': answer_ids}
+        
+    except Exception as e:
+        # 音声の事前合成は高速化用途のため、更新処理全体は継続する
+        logger.error(f"Failed to prerender audio prompts: {str(e)}")
+        return {'error': str(e)}
+
+def handle_audio_prerender() -> Dict[str, Any]:
+    """
+    回答音声の事前合成を実行し、実行時キャッシュを無効化
+    """
+    response = s3.get_object(Bucket=S3_BUCKET, Key='qa-data/qa-knowledge.json')
+    qa_data = json.loads(response['Body'].read().decode('utf-8'))
+    
+    result = prerender_audio_prompts(qa_data)
+    if 'error' not in result:
+        create_tracker().publish_knowledge_version('prerender_audio', result)
+    
+    return {
+        'statusCode': 200 if 'error' not in result else 500,
+        'body': {
+            'message': 'Audio prompts prerendered' if 'error' not in result else 'Audio prerender failed',
+            'details': result
+        }
+    }
+
+def build_static_responses(qa_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    正規化した質問文からQ&Aへの完全一致テーブルを作成してS3に保存
+    helpdesk_processorは検索・生成の前にこのテーブルを参照する
+    """
+    try:
+        table = build_static_table(qa_data)
+        
+        s3.put_object(
+            Bucket=S3_BUCKET,
+            Key=STATIC_RESPONSES_KEY,
+            Body=json.dumps(table, ensure_ascii=False, separators=(',', ':')),
+            ContentType='application/json'
+        )
+        
+        logger.info(f"Static response table built: {len(table['entries'])} variants for {len(table['answers'])} answers")
+        return {'variants': len(table['entries']), 'answers': len(table['answers'])}
+        
+    except Exception as e:
+        # 完全一致テーブルは高速化用途のため、更新処理全体は継続する
+        logger.error(f"Failed to build static response table: {str(e)}")
+        return {'error': str(e)}
+
+def build_vector_index(qa_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Q&Aデータの埋め込み行列を構築してS3に保存
+    Knowledge Baseが利用できない場合のローカルベクトル検索で使用する
+    内容が変わっていないエントリは前回の埋め込みを再利用する
+    """
+    try:
+        previous = None
+        try:
+            previous_object = s3.get_object(Bucket=S3_BUCKET, Key=VECTOR_INDEX_KEY)
+            previous = VectorIndex.from_bytes(previous_object['Body'].read())
+            # 埋め込みモデル・次元数が変わった場合は全件を埋め込み直す
+            previous_model_id = previous_object.get('Metadata', {}).get('model-id')
+            if previous.dimensions != EMBEDDING_DIMENSIONS or previous_model_id != EMBEDDING_MODEL_ID:
+                logger.info(f"Vector index built with {previous_model_id} ({previous.dimensions} dims), re-embedding all entries")
+                previous = None
+        except Exception as e:
+            logger.info(f"No reusable vector index: {str(e)}")
+        
+        embedded = []
+        
+        def embed(text: str) -> List[float]:
+            embedded.append(text)
+            return embed_with_bedrock(bedrock_runtime, EMBEDDING_MODEL_ID, text, EMBEDDING_DIMENSIONS)
+        
+        index = VectorIndex.build(qa_data, embed, dtype=VECTOR_INDEX_DTYPE, previous=previous)
+        body = index.to_bytes()
+        
+        s3.put_object(
+            Bucket=S3_BUCKET,
+            Key=VECTOR_INDEX_KEY,
+            Body=body,
+            ContentType='application/octet-stream',
+            Metadata={'model-id': EMBEDDING_MODEL_ID}
+        )
+        
+        logger.info(f"Vector index built: {len(index.ids)} entries ({len(embedded)} embedded, {len(body)} bytes)")
+        return {'entries': len(index.ids), 'embedded': len(embedded), 'bytes': len(body)}
+        
+    except Exception as e:
+        # ローカル検索はフォールバック用途のため、更新処理全体は継続する
+        logger.error(f"Failed to build vector index: {str(e)}")
+        return {'error': str(e)}
+
 def sync_knowledge_base() -> Dict[str, Any]:
     """
     Bedrock Knowledge Baseとの同期
@@ -277,6 +491,7 @@ def sync_knowledge_base() -> Dict[str, Any]:
         
         return {
             'jobId': job_id,
+            'dataSourceId': data_source_id,
             'status': 'started',
             'timestamp': datetime.utcnow().isoformat()
         }
@@ -297,16 +512,120 @@ def trigger_ingestion_job() -> Dict[str, Any]:
         logger.error(f"Failed to trigger ingestion: {str(e)}")
         raise
 
-def record_update_history(sync_result: Dict[str, Any]):
+def create_tracker() -> IngestionTracker:
+    """
+    Ingestionジョブ追跡用のトラッカーを作成
+    """
+    return IngestionTracker(
+        bedrock_agent,
+        s3,
+        knowledge_base_id=KNOWLEDGE_BASE_ID,
+        bucket=S3_BUCKET,
+        poll_interval=INGESTION_POLL_INTERVAL
+    )
+
+def track_ingestion_job(job_id: str, data_source_id: str, context: Any = None,
+                        resume_count: int = 0) -> Dict[str, Any]:
+    """
+    Ingestionジョブを終了状態まで追跡し、完了時にナレッジバージョンを公開
+    Lambdaの残り時間内に終了しない場合は途中経過を返し、
+    track_ingestionアクションで自身を非同期に呼び出して追跡を再開する
+    """
+    tracker = create_tracker()
+    
+    timeout = get_tracking_timeout(context)
+    summary = tracker.wait_for_completion(job_id, data_source_id, timeout)
+    
+    if summary['status'] == 'COMPLETE':
+        summary['knowledgeVersion'] = tracker.publish_knowledge_version(job_id, summary['statistics'])
+    elif summary['terminal']:
+        logger.error(f"Ingestion job {job_id} did not complete: {summary.get('failureReasons')}")
+    else:
+        summary['resumeEvent'] = {
+            'action': 'track_ingestion',
+            'jobId': job_id,
+            'dataSourceId': data_source_id,
+            'resumeCount': resume_count + 1
+        }
+        summary['resumeDispatched'] = dispatch_resume_event(summary['resumeEvent'], context)
+    
+    return summary
+
+def dispatch_resume_event(resume_event: Dict[str, Any], context: Any) -> bool:
+    """
+    追跡再開のイベントで自身を非同期に呼び出す
+    
+    Returns:
+        呼び出しに成功した場合True（失敗時はresumeEventを手動で実行して再開する）
+    """
+    function_arn = getattr(context, 'invoked_function_arn', None)
+    if not function_arn:
+        logger.info("No Lambda context, ingestion tracking must be resumed manually")
+        return False
+    
+    if resume_event['resumeCount'] > INGESTION_MAX_RESUMES:
+        logger.error(f"Ingestion job {resume_event['jobId']} still running after {INGESTION_MAX_RESUMES} resumes, giving up tracking")
+        return False
+    
+    try:
+        lambda_client.invoke(
+            FunctionName=function_arn,
+            InvocationType='Event',
+            Payload=json.dumps(resume_event).encode('utf-8')
+        )
+        logger.info(f"Ingestion tracking resumed asynchronously: {resume_event['jobId']} (#{resume_event['resumeCount']})")
+        return True
+    except Exception as e:
+        structured_logger.log_error('dispatch_resume_event', e)
+        return False
+
+def get_tracking_timeout(context: Any) -> float:
+    """
+    Lambdaの残り実行時間から追跡の上限時間を算出
+    """
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return 0.0
+    return max(context.get_remaining_time_in_millis() / 1000.0 - INGESTION_TRACKING_MARGIN, 0.0)
+
+def handle_ingestion_tracking(job_id: str, data_source_id: str, context: Any = None,
+                              resume_count: int = 0) -> Dict[str, Any]:
+    """
+    実行中のIngestionジョブの追跡を再開
+    """
+    try:
+        summary = track_ingestion_job(job_id, data_source_id, context, resume_count)
+        
+        record_update_history({
+            'jobId': job_id,
+            'dataSourceId': data_source_id,
+            'ingestion': summary,
+            'timestamp': datetime.utcnow().isoformat()
+        }, update_type='ingestion_tracking')
+        
+        return {
+            'statusCode': 200,
+            'body': {
+                'message': 'Ingestion job tracked',
+                'jobId': job_id,
+                'ingestion': summary
+            }
+        }
+        
+    except Exception as e:
+        logger.error(f"Error tracking ingestion job: {str(e)}")
+        raise
+
+def record_update_history(sync_result: Dict[str, Any], update_type: str = 'scheduled_update'):
     """
     更新履歴を記録
+    同一ジョブの履歴は追跡の進行に合わせて上書きされる
     """
     try:
         history_entry = {
             'timestamp': datetime.utcnow().isoformat(),
             'environment': ENVIRONMENT,
             'sync_result': sync_result,
-            'type': 'scheduled_update'
+            'type': update_type
         }
         
         # 履歴をS3に保存
@@ -315,7 +634,7 @@ def record_update_history(sync_result: Dict[str, Any]):
         s3.put_object(
             Bucket=S3_BUCKET,
             Key=history_key,
-            Body=json.dumps(history_entry),
+            Body=json.dumps(history_entry, default=str),
             ContentType='application/json'
         )
         
@@ -0,0 +1,180 @@
+import math
+from string import Template
+from typing import Dict, Any, List, Optional
+
+# 回答生成の指示（全リクエストで共通の静的な接頭部）
+# 呼び出しごとの入力トークンとなるため、従来のプロンプトの指示文と同程度の長さに保つ
+SYSTEM_INSTRUCTIONS = """あなたはレジシステムのサポート担当者です。
+電話の質問に丁寧かつ簡潔に回答してください。
+技術的な詳細は避け、操作手順を中心に記号を使わず3文程度で説明してください。"""
+
+# テンプレートはインポート時にコンパイルし、リクエストごとの組み立てを最小限にする
+_EXAMPLE_TEMPLATE = Template('質問: $question\n回答: $answer')
+_SYSTEM_TEMPLATE = Template('$instructions\n\n以下は過去の回答例です。\n\n$examples')
+_USER_TEMPLATE = Template('質問: $question')
+_COMPLETION_TEMPLATE = Template('$system\n\n質問: $question\n\n回答:')
+
+# Bedrockのプロンプトキャッシュに対応するClaudeモデル（モデルIDの部分一致）と
+# キャッシュ対象となる最小トークン数。先に一致したものを使用する
+# 既定のBEDROCK_MODEL_ID（claude-3-5-sonnet-20241022）は非対応のため、キャッシュは使用されない
+PROMPT_CACHE_MODELS = (
+    ('claude-3-7-sonnet', 1024),
+    ('claude-3-5-haiku', 2048),
+    ('claude-sonnet-4', 1024),
+    ('claude-opus-4-5', 4096),
+    ('claude-opus-4', 1024),
+    ('claude-haiku-4', 4096)
+)
+
+# 回答例に使用するトークン数の上限（0の場合は回答例を含めない）
+# 回答例は呼び出しごとの入力トークンを増やすため、既定では含めない
+DEFAULT_EXAMPLE_TOKEN_BUDGET = 0
+# カテゴリの指定がない場合に各カテゴリから選ぶ回答例の件数
+GENERIC_EXAMPLES_PER_CATEGORY = 1
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算
+    日本語は1文字1トークン、ASCIIは4文字1トークンとして数える（上限判定用の保守的な見積もり）
+    """
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+def is_claude_model(model_id: str) -> bool:
+    """ClaudeのモデルIDか（'anthropic.'や推論プロファイルの接頭辞付きのIDを含む）"""
+    return 'claude' in model_id
+
+def prompt_cache_min_tokens(model_id: str) -> Optional[int]:
+    """キャッシュ対象となる最小トークン数（プロンプトキャッシュ非対応のモデルはNone）"""
+    for name, min_tokens in PROMPT_CACHE_MODELS:
+        if name in model_id:
+            return min_tokens
+    return None
+
+def supports_prompt_cache(model_id: str) -> bool:
+    """モデルがBedrockのプロンプトキャッシュに対応しているか"""
+    return prompt_cache_min_tokens(model_id) is not None
+
+class PromptLibrary:
+    """
+    Q&Aデータから選んだカテゴリ別の回答例と、それを含むシステムプロンプト
+    システムプロンプトはカテゴリごとに1回だけ組み立て、以降は同じ文字列を返す
+    （同一の接頭部となり、プロンプトキャッシュが効く）
+    min_tokensを指定した場合は、システムプロンプトがその長さに届くまで他カテゴリの回答例で補う
+    （回答例を全て使っても届かない場合は補わない）
+    """
+    def __init__(self, qa_data: List[Dict[str, Any]], token_budget: int = DEFAULT_EXAMPLE_TOKEN_BUDGET,
+                 min_tokens: Optional[int] = None):
+        self.token_budget = token_budget
+        self.min_tokens = min_tokens
+        self.examples: Dict[str, List[str]] = {}
+        for qa in sorted(qa_data, key=lambda qa: len(qa['answer'])):
+            # 回答の短いQ&Aから順に使用し、予算内でより多くの例を含める
+            example = _EXAMPLE_TEMPLATE.substitute(question=qa['question'], answer=qa['answer'])
+            self.examples.setdefault(qa['category'], []).append(example)
+        self.system_prompts: Dict[Optional[str], str] = {}
+
+    def _select(self, candidates: List[str]) -> List[str]:
+        selected, used = [], 0
+        for example in candidates:
+            tokens = estimate_tokens(example)
+            if used + tokens > self.token_budget:
+                continue
+            selected.append(example)
+            used += tokens
+        return selected
+
+    def system_prompt(self, category: Optional[str] = None) -> str:
+        """
+        システムプロンプトを取得
+
+        Args:
+            category: 検索結果のカテゴリ（該当カテゴリの回答例を使用）。
+                未知のカテゴリ・Noneの場合は各カテゴリの代表例を使用する
+
+        Returns:
+            システムプロンプト
+        """
+        if category not in self.examples:
+            category = None
+        prompt = self.system_prompts.get(category)
+        if prompt is not None:
+            return prompt
+
+        if category is not None:
+            candidates = self.examples[category]
+        else:
+            candidates = [
+                example
+                for name in sorted(self.examples)
+                for example in self.examples[name][:GENERIC_EXAMPLES_PER_CATEGORY]
+            ]
+        examples = self._select(candidates)
+        prompt = self._render(examples)
+
+        if self.min_tokens is not None:
+            # キャッシュの最小トークン数に満たない接頭部はキャッシュされないため、他の回答例で補う
+            others = [
+                example
+                for name in sorted(self.examples)
+                for example in self.examples[name]
+                if example not in examples
+            ]
+            padded = list(examples)
+            for example in others:
+                if estimate_tokens(self._render(padded)) >= self.min_tokens:
+                    break
+                padded.append(example)
+            # 回答例が足りず最小トークン数に届かない場合は、キャッシュされない入力を増やさないよう補わない
+            if estimate_tokens(self._render(padded)) >= self.min_tokens:
+                prompt = self._render(padded)
+
+        self.system_prompts[category] = prompt
+        return prompt
+
+    def _render(self, examples: List[str]) -> str:
+        if not examples:
+            return SYSTEM_INSTRUCTIONS
+        return _SYSTEM_TEMPLATE.substitute(instructions=SYSTEM_INSTRUCTIONS, examples='\n\n'.join(examples))
+
+def build_request_body(model_id: str, system_prompt: str, question: str,
+                       max_tokens: int = 500, temperature: float = 0.7) -> Dict[str, Any]:
+    """
+    Bedrockのinvoke_model用のリクエストボディを作成
+
+    Args:
+        model_id: BedrockのモデルID
+        system_prompt: PromptLibrary.system_promptの結果
+        question: ユーザーの質問
+        max_tokens: 最大出力トークン数
+        temperature: 生成の温度
+
+    Returns:
+        リクエストボディ
+    """
+    if is_claude_model(model_id):
+        system_block: Dict[str, Any] = {'type': 'text', 'text': system_prompt}
+        min_tokens = prompt_cache_min_tokens(model_id)
+        if min_tokens is not None and estimate_tokens(system_prompt) >= min_tokens:
+            # 静的な接頭部をキャッシュ対象とし、2回目以降の入力トークンの処理を省く
+            # （最小トークン数に満たない場合はキャッシュされないため指定しない）
+            system_block['cache_control'] = {'type': 'ephemeral'}
+        return {
+            'anthropic_version': 'bedrock-2023-05-31',
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'system': [system_block],
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': _USER_TEMPLATE.substitute(question=question)
+                }
+            ]
+        }
+
+    # Amazon Nova等の他のモデル用
+    return {
+        'prompt': _COMPLETION_TEMPLATE.substitute(system=system_prompt, question=question),
+        'max_tokens': max_tokens,
+        'temperature': temperature
+    }
@@ -1,9 +1,13 @@
 import boto3
+import json
 import logging
-from datetime import datetime
-from typing import Dict, Any, Optional
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List
 import os
 
+import structured_logger
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -93,7 +97,7 @@ class QualityMetrics:
                     Namespace=self.namespace,
                     MetricData=metrics
                 )
-                logger.info(f"Recorded {len(metrics)} metrics to CloudWatch")
+                logger.debug(f"Recorded {len(metrics)} metrics to CloudWatch")
             
         except Exception as e:
             logger.error(f"Failed to record metrics: {str(e)}")
@@ -207,6 +211,88 @@ class QualityMetrics:
         except Exception as e:
             logger.error(f"Failed to record Bedrock metrics: {str(e)}")
 
+    def emit_answer_usage(self, answer_id: str):
+        """
+        回答の利用回数を記録（音声の事前合成対象の選択に使用）
+        呼び出しごとのAPI呼び出しを避けるため、Embedded Metric Format（ログ出力）で記録する
+        """
+        print(json.dumps({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Environment', 'AnswerId']],
+                    'Metrics': [{'Name': 'AnswerServed', 'Unit': 'Count'}]
+                }]
+            },
+            'Environment': self.environment,
+            'AnswerId': answer_id,
+            'AnswerServed': 1
+        }))
+    
+    def emit_generation_metrics(self, counters: Dict[str, Any]):
+        """
+        Bedrock生成の試行・スロットリング・負荷制限の件数と同時実行上限を記録
+        スロットリング率・負荷制限率はGenerationAttemptsとの比で算出する
+        （Embedded Metric Format）
+        """
+        print(json.dumps({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Environment']],
+                    'Metrics': [
+                        {'Name': 'GenerationAttempts', 'Unit': 'Count'},
+                        {'Name': 'BedrockThrottleCount', 'Unit': 'Count'},
+                        {'Name': 'LoadShedCount', 'Unit': 'Count'},
+                        {'Name': 'GenerationConcurrencyLimit', 'Unit': 'None'}
+                    ]
+                }]
+            },
+            'Environment': self.environment,
+            'GenerationAttempts': counters.get('attempts', 0),
+            'BedrockThrottleCount': counters.get('throttled', 0),
+            'LoadShedCount': counters.get('shed', 0),
+            'GenerationConcurrencyLimit': counters.get('limit', 0)
+        }))
+    
+    def get_answer_usage(self, answer_ids: List[str], days: int = 7) -> Dict[str, float]:
+        """回答ごとの利用回数を取得"""
+        end_time = datetime.utcnow()
+        start_time = end_time - timedelta(days=days)
+        usage = {answer_id: 0.0 for answer_id in answer_ids}
+        
+        # GetMetricDataは1リクエストあたり500クエリまで
+        for offset in range(0, len(answer_ids), 500):
+            chunk = answer_ids[offset:offset + 500]
+            queries = [
+                {
+                    'Id': f'q{idx}',
+                    'MetricStat': {
+                        'Metric': {
+                            'Namespace': self.namespace,
+                            'MetricName': 'AnswerServed',
+                            'Dimensions': [
+                                {'Name': 'Environment', 'Value': self.environment},
+                                {'Name': 'AnswerId', 'Value': answer_id}
+                            ]
+                        },
+                        'Period': days * 86400,
+                        'Stat': 'Sum'
+                    }
+                }
+                for idx, answer_id in enumerate(chunk)
+            ]
+            
+            paginator = self.cloudwatch.get_paginator('get_metric_data')
+            for page in paginator.paginate(MetricDataQueries=queries, StartTime=start_time, EndTime=end_time):
+                for result in page['MetricDataResults']:
+                    answer_id = chunk[int(result['Id'][1:])]
+                    usage[answer_id] += sum(result['Values'])
+        
+        return usage
+
 # Lambda関数として使用する場合のハンドラ
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -214,11 +300,12 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     Connect Contact Flowから直接呼び出されることもある
     """
     metrics = QualityMetrics()
+    event_type = event.get('type', 'call_metrics')
+    log = structured_logger.begin('quality_metrics', type=event_type)
+    log.verbose(data=event.get('data', {}))
     
     try:
         # イベントタイプに応じて処理
-        event_type = event.get('type', 'call_metrics')
-        
         if event_type == 'call_metrics':
             metrics.record_call_metrics(event.get('data', {}))
         elif event_type == 'kb_metrics':
@@ -226,7 +313,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         elif event_type == 'bedrock_metrics':
             metrics.record_bedrock_metrics(event.get('data', {}))
         else:
-            logger.warning(f"Unknown event type: {event_type}")
+            log.error('lambda_handler', ValueError(f"Unknown event type: {event_type}"), escalate=False)
         
         return {
             'statusCode': 200,
@@ -234,8 +321,11 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
         
     except Exception as e:
-        logger.error(f"Error in metrics handler: {str(e)}")
+        log.error('lambda_handler', e)
         return {
             'statusCode': 500,
             'body': {'error': str(e)}
-        }
\ No newline at end of file
+        }
+    
+    finally:
+        log.emit()
\ No newline at end of file
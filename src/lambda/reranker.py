@@ -0,0 +1,192 @@
+"""
+検索候補の再ランキングと信頼度の校正
+
+Knowledge Base・ローカルベクトル検索・キーワードマッチングの候補を
+Reciprocal Rank Fusionで統合し、ロジスティック回帰で校正した
+「最上位候補が正答である確率」を信頼度として返す
+
+校正パラメータの学習（batch_evaluatorの出力を使用）:
+    python src/lambda/reranker.py results.jsonl --output calibration.json
+    aws s3 cp calibration.json s3://<bucket>/knowledge-artifacts/calibration.json
+"""
+import argparse
+import json
+import math
+import sys
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+# 校正パラメータ
+# 注：qa-data/ はKnowledge Baseのデータソース対象のため、別プレフィックスに配置する
+CALIBRATION_KEY = 'knowledge-artifacts/calibration.json'
+
+# Reciprocal Rank Fusionの定数
+RRF_K = 60
+
+FEATURE_NAMES = ['rrf', 'kb_score', 'vector_score', 'lexical_score', 'agreement', 'margin']
+
+# 校正パラメータ未学習時の既定値
+# 保守的な値とし、複数の検索ソースが同じ候補を高いスコアで上位に挙げた場合のみ閾値を超える
+# （単一ソースのみの弱い一致では生成にフォールバックする）
+# キーワードマッチングのみの構成（Knowledge Base・埋め込み行列なし）では、
+# キーワード2件以上の一致（lexical_score≥0.67）で閾値0.5を超え、1件のみの一致は超えない
+DEFAULT_CALIBRATION = {
+    'bias': -5.75,
+    'weights': {
+        'rrf': 1.5,
+        'kb_score': 2.5,
+        'vector_score': 2.0,
+        'lexical_score': 4.0,
+        'agreement': 2.0,
+        'margin': 0.5
+    }
+}
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[str]], k: int = RRF_K) -> List[tuple[float, str]]:
+    """
+    複数の検索結果の順位を統合
+
+    Args:
+        rankings: 検索ソース名ごとの候補IDリスト（順位順）
+        k: RRFの平滑化定数
+
+    Returns:
+        （統合スコア, 候補ID）のリスト（降順）
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings.values():
+        for rank, candidate_id in enumerate(ranking, start=1):
+            fused[candidate_id] = fused.get(candidate_id, 0.0) + 1.0 / (k + rank)
+
+    return sorted(((score, candidate_id) for candidate_id, score in fused.items()),
+                  key=lambda item: item[0], reverse=True)
+
+def extract_features(candidate_id: str, fused: List[tuple[float, str]],
+                     rankings: Dict[str, List[str]], scores: Dict[str, Dict[str, float]],
+                     k: int = RRF_K) -> Dict[str, float]:
+    """
+    最上位候補の校正用特徴量を算出
+
+    Args:
+        candidate_id: 対象の候補ID
+        fused: reciprocal_rank_fusionの結果
+        rankings: 検索を実行したソース名ごとの候補IDリスト（候補がない場合も空リストで含める）
+        scores: 検索ソース名ごとの候補IDごとの正規化済みスコア（0〜1）
+        k: RRFの平滑化定数
+
+    Returns:
+        特徴量
+    """
+    # 候補を返したソースではなく検索したソースの数で正規化する
+    # （1ソースのみの弱い一致が満点の一致度・マージンにならないようにする）
+    sources = list(rankings)
+    max_fused = len(sources) / (k + 1) if sources else 1.0
+
+    fused_scores = dict((cid, score) for score, cid in fused)
+    top_score = fused_scores.get(candidate_id, 0.0)
+    runner_up = next((score for score, cid in fused if cid != candidate_id), 0.0)
+
+    first_votes = sum(1 for name in sources if rankings[name] and rankings[name][0] == candidate_id)
+
+    return {
+        'rrf': top_score / max_fused if max_fused else 0.0,
+        'kb_score': scores.get('kb', {}).get(candidate_id, 0.0),
+        'vector_score': scores.get('vector', {}).get(candidate_id, 0.0),
+        'lexical_score': scores.get('lexical', {}).get(candidate_id, 0.0),
+        'agreement': first_votes / len(sources) if sources else 0.0,
+        'margin': (top_score - runner_up) / max_fused if max_fused else 0.0
+    }
+
+class Calibrator:
+    """特徴量から正答確率を算出するロジスティック回帰"""
+    def __init__(self, parameters: Optional[Dict[str, Any]] = None):
+        parameters = parameters or DEFAULT_CALIBRATION
+        self.bias = parameters['bias']
+        self.weights = parameters['weights']
+
+    def probability(self, features: Dict[str, float]) -> float:
+        z = self.bias + sum(self.weights.get(name, 0.0) * features.get(name, 0.0) for name in FEATURE_NAMES)
+        return sigmoid(z)
+
+def sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+def fit_calibration(examples: List[tuple[Dict[str, float], int]], epochs: int = 500,
+                    learning_rate: float = 0.5, l2: float = 0.01) -> Dict[str, Any]:
+    """
+    ラベル付きの特徴量から校正パラメータを学習（勾配降下法）
+
+    Args:
+        examples: （特徴量, 最上位候補が正答なら1）のリスト
+        epochs: 反復回数
+        learning_rate: 学習率
+        l2: L2正則化係数
+
+    Returns:
+        校正パラメータ
+    """
+    if not examples:
+        raise ValueError("No labeled examples to fit")
+
+    weights = {name: 0.0 for name in FEATURE_NAMES}
+    bias = 0.0
+    n = len(examples)
+
+    for _ in range(epochs):
+        grad_w = {name: 0.0 for name in FEATURE_NAMES}
+        grad_b = 0.0
+        for features, label in examples:
+            error = sigmoid(bias + sum(weights[f] * features.get(f, 0.0) for f in FEATURE_NAMES)) - label
+            grad_b += error
+            for f in FEATURE_NAMES:
+                grad_w[f] += error * features.get(f, 0.0)
+        bias -= learning_rate * grad_b / n
+        for f in FEATURE_NAMES:
+            weights[f] -= learning_rate * (grad_w[f] / n + l2 * weights[f])
+
+    calibrator = Calibrator({'bias': bias, 'weights': weights})
+    brier = sum((calibrator.probability(features) - label) ** 2 for features, label in examples) / n
+
+    return {
+        'bias': bias,
+        'weights': weights,
+        'fittedAt': datetime.utcnow().isoformat(),
+        'examples': n,
+        'brierScore': brier
+    }
+
+def load_examples(path: str) -> List[tuple[Dict[str, float], int]]:
+    """batch_evaluatorの出力からラベル付きの特徴量を読み込む"""
+    examples = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if result.get('features') is None or result.get('top1_correct') is None:
+                continue
+            examples.append((result['features'], int(result['top1_correct'])))
+    return examples
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='ラベル付き書き起こしの評価結果から信頼度の校正パラメータを学習')
+    parser.add_argument('results', help='batch_evaluatorの出力（JSONL）')
+    parser.add_argument('--output', default='calibration.json', help='校正パラメータの出力先')
+    parser.add_argument('--epochs', type=int, default=500)
+    parser.add_argument('--learning-rate', type=float, default=0.5)
+    parser.add_argument('--l2', type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    parameters = fit_calibration(load_examples(args.results), args.epochs, args.learning_rate, args.l2)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(parameters, f, ensure_ascii=False, indent=2)
+
+    print(f"Fitted on {parameters['examples']} examples (Brier score: {parameters['brierScore']:.4f})")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+class DynamoDBLeaseStore:
+    """
+    コンテナ間で共有するリースと結果の保存先（DynamoDB）
+    テーブルのパーティションキーは'pk'、TTL属性は'expiresAt'
+    """
+    def __init__(self, dynamodb_client, table_name: str, clock: Callable[[], float] = time.time):
+        self.dynamodb = dynamodb_client
+        self.table_name = table_name
+        self.clock = clock
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """リースを取得（未取得または期限切れの場合のみ成功）"""
+        now = self.clock()
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'pk': {'S': key},
+                    'owner': {'S': owner},
+                    'status': {'S': 'pending'},
+                    'expiresAt': {'N': str(int(now + ttl))}
+                },
+                ConditionExpression='attribute_not_exists(pk) OR expiresAt < :now',
+                ExpressionAttributeValues={':now': {'N': str(int(now))}}
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def publish(self, key: str, owner: str, result: Dict[str, Any], ttl: float):
+        """リース保持者として結果を公開"""
+        self.dynamodb.put_item(
+            TableName=self.table_name,
+            Item={
+                'pk': {'S': key},
+                'owner': {'S': owner},
+                'status': {'S': 'done'},
+                'result': {'S': json.dumps(result, ensure_ascii=False)},
+                'expiresAt': {'N': str(int(self.clock() + ttl))}
+            }
+        )
+
+    def release(self, key: str, owner: str):
+        """結果を公開せずにリースを解放（リーダーの処理失敗時・結果を共有しない場合）"""
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table_name,
+                Key={'pk': {'S': key}},
+                ConditionExpression='#owner = :owner AND #status = :pending',
+                ExpressionAttributeNames={'#owner': 'owner', '#status': 'status'},
+                ExpressionAttributeValues={':owner': {'S': owner}, ':pending': {'S': 'pending'}}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+
+    def get_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        リースの状態を取得
+
+        Returns:
+            status（pending・done）とresult（公開済みの場合）。リースがない・期限切れの場合はNone
+        """
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={'pk': {'S': key}},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        # DynamoDBのTTL削除は遅延するため期限を自前で確認
+        if not item or float(item['expiresAt']['N']) < self.clock():
+            return None
+        if item['status']['S'] != 'done':
+            return {'status': 'pending'}
+        return {'status': 'done', 'result': json.loads(item['result']['S'])}
+
+class InMemoryLeaseStore:
+    """
+    DynamoDBLeaseStoreのローカル代替
+    単一プロセス内での検証・オフライン実行用
+    """
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.clock = clock
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        with self.lock:
+            item = self.items.get(key)
+            if item and item['expiresAt'] >= self.clock():
+                return False
+            self.items[key] = {'owner': owner, 'status': 'pending', 'expiresAt': self.clock() + ttl}
+            return True
+
+    def publish(self, key: str, owner: str, result: Dict[str, Any], ttl: float):
+        with self.lock:
+            self.items[key] = {
+                'owner': owner,
+                'status': 'done',
+                'result': json.loads(json.dumps(result)),
+                'expiresAt': self.clock() + ttl
+            }
+
+    def release(self, key: str, owner: str):
+        with self.lock:
+            item = self.items.get(key)
+            if item and item['owner'] == owner and item['status'] == 'pending':
+                del self.items[key]
+
+    def get_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            item = self.items.get(key)
+            if not item or item['expiresAt'] < self.clock():
+                return None
+            if item['status'] != 'done':
+                return {'status': 'pending'}
+            return {'status': 'done', 'result': item['result']}
+
+class _Call:
+    """コンテナ内で実行中の呼び出し"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    同一キーの同時リクエストを1回の処理にまとめる
+    コンテナ内はスレッド間で、コンテナ間は共有ストアのリースで重複を排除する
+    フォロワーはリーダーの結果を短時間待ち、得られなければ自身で処理する
+    """
+    def __init__(self, store=None, lease_ttl: float = 10.0, result_ttl: float = 30.0,
+                 wait_timeout: float = 5.0, poll_interval: float = 0.2,
+                 sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.time):
+        self.store = store
+        self.lease_ttl = lease_ttl
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.sleep = sleep
+        self.clock = clock
+        self.owner = str(uuid.uuid4())
+        self.lock = threading.Lock()
+        self.calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Dict[str, Any]],
+           publish_if: Optional[Callable[[Dict[str, Any]], bool]] = None,
+           deadline: Optional[float] = None) -> tuple[Dict[str, Any], bool]:
+        """
+        キーに対する処理を重複排除して実行
+
+        Args:
+            key: 重複排除のキー
+            fn: 処理本体（JSONシリアライズ可能な辞書を返す）
+            publish_if: 結果を他のコンテナと共有するかの判定（エラー応答の共有を避ける）
+            deadline: 回答を返すべき時刻（epoch秒）。リーダーの結果の待機はwait_timeoutとこの時刻の早い方まで
+
+        Returns:
+            （結果, 他のリクエストの結果を共有した場合はTrue）
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+
+        if not leader:
+            if call.done.wait(max(self._wait_until(deadline) - self.clock(), 0.0)):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            logger.info(f"Single-flight leader did not finish in time, processing locally: {key}")
+            return fn(), False
+
+        try:
+            call.result, shared = self._do_shared(key, fn, publish_if, deadline)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def _wait_until(self, deadline: Optional[float]) -> float:
+        """フォロワーがリーダーの結果を待つ期限"""
+        wait_until = self.clock() + self.wait_timeout
+        return min(wait_until, deadline) if deadline is not None else wait_until
+
+    def _do_shared(self, key: str, fn: Callable[[], Dict[str, Any]],
+                   publish_if: Optional[Callable[[Dict[str, Any]], bool]],
+                   deadline: Optional[float]) -> tuple[Dict[str, Any], bool]:
+        """共有ストアのリースによるコンテナ間の重複排除"""
+        if self.store is None:
+            return fn(), False
+
+        try:
+            wait_until = self._wait_until(deadline)
+            while True:
+                entry = self.store.get_entry(key)
+                if entry is not None and entry['status'] == 'done':
+                    return entry['result'], True
+
+                # リースがない（リーダーが結果を公開せずに解放した場合を含む）ときは自身がリーダーになる
+                if entry is None and self.store.acquire(key, self.owner, self.lease_ttl):
+                    return self._lead(key, fn, publish_if), False
+
+                if self.clock() >= wait_until:
+                    break
+                self.sleep(self.poll_interval)
+
+            logger.info(f"Single-flight leader did not publish in time, processing locally: {key}")
+
+        except ClientError as e:
+            # 共有ストアの障害時は重複排除せずに処理する
+            logger.error(f"Single-flight store error: {e}")
+
+        return fn(), False
+
+    def _lead(self, key: str, fn: Callable[[], Dict[str, Any]],
+              publish_if: Optional[Callable[[Dict[str, Any]], bool]]) -> Dict[str, Any]:
+        try:
+            result = fn()
+        except BaseException:
+            self.store.release(key, self.owner)
+            raise
+        try:
+            if publish_if is None or publish_if(result):
+                self.store.publish(key, self.owner, result, self.result_ttl)
+            else:
+                self.store.release(key, self.owner)
+        except ClientError as e:
+            logger.error(f"Failed to publish single-flight result: {e}")
+        return result
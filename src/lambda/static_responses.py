@@ -0,0 +1,76 @@
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from text_normalizer import canonical_key
+
+logger = logging.getLogger()
+
+# 完全一致応答テーブル
+# 注：qa-data/ はKnowledge Baseのデータソース対象のため、別プレフィックスに配置する
+STATIC_RESPONSES_KEY = 'knowledge-artifacts/static-responses.json'
+
+# 単独で質問として扱うキーワードの最小文字数（「電源」等の短い語は曖昧なため除外）
+MIN_KEYWORD_VARIANT_LENGTH = 5
+
+def question_variants(qa: Dict[str, Any]) -> List[str]:
+    """
+    Q&Aエントリに対応する質問文のバリエーション
+    質問文・十分に具体的なキーワード・任意のvariantsフィールドを対象とする
+    """
+    variants = [qa['question']]
+    variants.extend(k for k in qa.get('keywords', []) if len(k) >= MIN_KEYWORD_VARIANT_LENGTH)
+    variants.extend(qa.get('variants', []))
+    return variants
+
+def build_static_table(qa_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    正規化した質問文のバリエーションからQ&A IDへの対応表を作成
+    複数のQ&Aに対応するバリエーションは曖昧なため除外する
+
+    Args:
+        qa_data: Q&Aデータ
+
+    Returns:
+        応答テーブル（entries: 正規化キー → Q&A ID, answers: Q&A ID → 回答）
+    """
+    owners: Dict[str, set] = {}
+    for qa in qa_data:
+        for variant in question_variants(qa):
+            key = canonical_key(variant)
+            if key:
+                owners.setdefault(key, set()).add(qa['id'])
+
+    entries = {key: next(iter(ids)) for key, ids in owners.items() if len(ids) == 1}
+    ambiguous = sorted(key for key, ids in owners.items() if len(ids) > 1)
+    if ambiguous:
+        logger.info(f"Excluded {len(ambiguous)} ambiguous variants: {ambiguous}")
+
+    referenced = set(entries.values())
+    answers = {
+        qa['id']: {'answer': qa['answer'], 'category': qa['category']}
+        for qa in qa_data if qa['id'] in referenced
+    }
+
+    return {
+        'generatedAt': datetime.utcnow().isoformat(),
+        'entries': entries,
+        'answers': answers
+    }
+
+def lookup(table: Dict[str, Any], question: str, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    質問文に完全一致（正規化後）する回答を検索
+
+    Args:
+        table: build_static_tableの結果
+        question: ユーザーの質問
+        key: 算出済みの正規化キー（省略時はquestionから算出）
+
+    Returns:
+        回答（id, answer, category）。該当しない場合はNone
+    """
+    qa_id = table['entries'].get(key if key is not None else canonical_key(question))
+    if qa_id is None:
+        return None
+    return dict(table['answers'][qa_id], id=qa_id)
@@ -0,0 +1,158 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+import traceback
+from typing import Dict, Any, Optional, Callable
+
+logger = logging.getLogger()
+
+# 詳細フィールド（イベント全体・音声認識結果など）を出力する呼び出しの割合
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+# 1フィールドあたりの最大文字数
+LOG_FIELD_MAX_CHARS = int(os.environ.get('LOG_FIELD_MAX_CHARS', '256'))
+# この秒数以上かかった呼び出しは詳細フィールドも出力する
+LOG_SLOW_THRESHOLD_SECONDS = float(os.environ.get('LOG_SLOW_THRESHOLD_SECONDS', '5'))
+
+# 実行中の呼び出しのログレコード（handle_error等から参照）
+_current: contextvars.ContextVar[Optional['InvocationLog']] = contextvars.ContextVar('invocation_log', default=None)
+
+def truncate(value: str, max_chars: int = LOG_FIELD_MAX_CHARS) -> str:
+    """文字列を最大文字数で切り詰める（切り詰めた文字数を末尾に付記）"""
+    if len(value) <= max_chars:
+        return value
+    return f"{value[:max_chars]}...(+{len(value) - max_chars})"
+
+def mask_phone(phone: str) -> str:
+    """電話番号を下4桁以外マスク"""
+    if not phone or phone == 'unknown':
+        return phone
+    return '*' * max(len(phone) - 4, 0) + phone[-4:]
+
+def _compact(value: Any, max_chars: int) -> Any:
+    """ログ出力用に値を縮約（文字列は切り詰め、構造体はJSON化して切り詰め）"""
+    if value is None or isinstance(value, (bool, int)):
+        return value
+    if isinstance(value, float):
+        return round(value, 3)
+    if isinstance(value, str):
+        return truncate(value, max_chars)
+    if isinstance(value, dict) and all(isinstance(v, (int, float)) for v in value.values()):
+        # ステージ別処理時間などの数値のみの辞書はそのまま出力
+        return {k: round(v, 3) if isinstance(v, float) else v for k, v in value.items()}
+    return truncate(json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str), max_chars)
+
+class _LazyRecord:
+    """ログ出力時にのみJSON化する（ログレベルで抑制された場合は整形しない）"""
+    def __init__(self, build: Callable[[], Dict[str, Any]]):
+        self.build = build
+
+    def __str__(self) -> str:
+        return json.dumps(self.build(), ensure_ascii=False, separators=(',', ':'), default=str)
+
+class InvocationLog:
+    """
+    1回の呼び出しにつき1件の構造化ログ
+    詳細フィールドは先頭サンプリング（呼び出し開始時の抽選）で選ばれた呼び出しと、
+    エラー・低速だった呼び出し（末尾サンプリング）でのみ出力する
+    """
+    def __init__(self, name: str, sample_rate: float = LOG_SAMPLE_RATE,
+                 max_chars: int = LOG_FIELD_MAX_CHARS, slow_threshold: float = LOG_SLOW_THRESHOLD_SECONDS,
+                 rand: Callable[[], float] = random.random, clock: Callable[[], float] = time.time):
+        self.fields: Dict[str, Any] = {'fn': name}
+        self.verbose_fields: Dict[str, Any] = {}
+        self.errors: list = []
+        self.escalated = False
+        self.max_chars = max_chars
+        self.slow_threshold = slow_threshold
+        self.clock = clock
+        self.start = clock()
+        self.sampled = rand() < sample_rate
+
+    def set(self, **fields):
+        """常に出力するフィールドを設定"""
+        self.fields.update(fields)
+
+    def verbose(self, **fields):
+        """サンプリング対象の詳細フィールドを設定（出力時まで整形しない）"""
+        self.verbose_fields.update(fields)
+
+    def error(self, context: str, error: BaseException, error_type: Optional[str] = None,
+              escalate: bool = True):
+        """
+        エラーを記録
+
+        Args:
+            context: エラーが発生したコンテキスト
+            error: 発生した例外
+            error_type: エラー種別
+            escalate: Trueの場合、詳細フィールドとスタックトレースも出力する
+        """
+        self.errors.append({
+            'context': context,
+            'type': error_type or type(error).__name__,
+            'message': str(error),
+            'exception': error if escalate else None
+        })
+        self.escalated = self.escalated or escalate
+
+    def emit(self):
+        """ログレコードを出力"""
+        duration = self.clock() - self.start
+        full = self.sampled or self.escalated or duration >= self.slow_threshold
+        level = logging.ERROR if self.escalated else (logging.WARNING if self.errors else logging.INFO)
+        logger.log(level, '%s', _LazyRecord(lambda: self._build(duration, full)))
+        if _current.get() is self:
+            _current.set(None)
+
+    def _build(self, duration: float, full: bool) -> Dict[str, Any]:
+        record = {k: _compact(v, self.max_chars) for k, v in self.fields.items()}
+        record['durationMs'] = int(duration * 1000)
+        if full:
+            record['sampled'] = True
+            for name, value in self.verbose_fields.items():
+                record[name] = _compact(value, self.max_chars)
+        if self.errors:
+            record['errors'] = [self._format_error(e) for e in self.errors]
+        return record
+
+    def _format_error(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        formatted = {
+            'context': entry['context'],
+            'type': entry['type'],
+            'message': truncate(entry['message'], self.max_chars)
+        }
+        error = entry['exception']
+        if error is not None and error.__traceback__ is not None:
+            # スタックトレースは通常のフィールドより長く残す
+            stack = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+            formatted['stack'] = truncate(stack, self.max_chars * 8)
+        return formatted
+
+def begin(name: str, **fields) -> InvocationLog:
+    """呼び出しのログレコードを開始"""
+    record = InvocationLog(name)
+    record.set(**fields)
+    _current.set(record)
+    return record
+
+def current() -> Optional[InvocationLog]:
+    """実行中の呼び出しのログレコード"""
+    return _current.get()
+
+def log_error(context: str, error: BaseException, error_type: Optional[str] = None,
+              escalate: bool = True):
+    """
+    エラーを実行中の呼び出しのログレコードに記録
+    ログレコードがない場合は単独のレコードとして出力する
+    フォールバックして処理を継続するエラーはescalate=Falseとし、詳細フィールドを出力しない
+    """
+    record = current()
+    if record is not None:
+        record.error(context, error, error_type, escalate)
+        return
+    record = InvocationLog(context, sample_rate=0.0)
+    record.error(context, error, error_type, escalate)
+    record.emit()
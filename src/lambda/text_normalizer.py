@@ -0,0 +1,98 @@
+import re
+import unicodedata
+
+# 言いよどみ（句読点・空白で区切られている場合、文頭・文末にある場合、言いよどみが続く場合のみ除去）
+# 例: 「えーと、パスワードを」「えーとえーとパスワードを」→「パスワードを」。「あのパソコン」のような連体詞は残す
+_FILLERS = ('えーっと', 'えーと', 'えっと', 'ええと', 'えー', 'あのー', 'あの', 'そのー', 'うーん', 'うー', 'んー', 'まあ')
+_FILLER_ALTERNATION = '(?:' + '|'.join(_FILLERS) + ')'
+_FILLER_PATTERN = re.compile(
+    r'(?:^|(?<=[\s、。，,]))' + _FILLER_ALTERNATION
+    + r'[ーぁぃぅぇぉっ〜~…]*(?:[\s、。，,]+|$|(?=' + _FILLER_ALTERNATION + '))'
+)
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# 音声認識の失敗とみなす文字の繰り返し（例: 「ああああ」「ーーー」）
+_REPEATED_CHAR_PATTERN = re.compile(r'^(.)\1+$')
+
+# 質問として扱う最小文字数（文字・数字のみ数える）
+MIN_MEANINGFUL_CHARS = 2
+
+# 文字・数字が全体に占める割合がこれ未満の場合は雑音とみなす
+MIN_MEANINGFUL_RATIO = 0.5
+
+# 記号・空白（キー生成時に除去）
+_PUNCTUATION_PATTERN = re.compile(r'[\s、。，．,.!?！？・「」『』（）()\[\]【】〜~-]+')
+
+# 文末の丁寧表現・終助詞（キー生成時に除去）
+_TRAILING_EXPRESSIONS = (
+    'んですけれども', 'んですけど', 'んですが', 'のですが', 'んですよ', 'んですね', 'んです',
+    'のですけど', 'のです', 'ですけど', 'ですが', 'ですね', 'ですよ', 'です',
+    'ますけど', 'ますが', 'ます', 'けど', 'よね', 'ね', 'よ', 'か'
+)
+
+def normalize_transcript(text: str) -> str:
+    """
+    音声認識結果の正規化（NFKC・空白の統一・言いよどみの除去）
+    検索・生成には正規化後の質問文を使用する
+
+    Args:
+        text: 音声認識結果
+
+    Returns:
+        正規化した質問文（言いよどみのみの場合は空文字列）
+    """
+    text = unicodedata.normalize('NFKC', text)
+    text = _WHITESPACE_PATTERN.sub(' ', text).strip()
+
+    # 「えーと、あの、」のように連続する場合があるため変化がなくなるまで除去
+    previous = None
+    while previous != text:
+        previous = text
+        text = _FILLER_PATTERN.sub('', text).strip()
+
+    return text
+
+def is_noise(text: str) -> bool:
+    """
+    正規化済みの質問文が音声認識の失敗（雑音・記号のみ・同一文字の繰り返し）か判定
+
+    Args:
+        text: normalize_transcriptの結果
+
+    Returns:
+        雑音とみなす場合はTrue
+    """
+    meaningful = [c for c in text if unicodedata.category(c)[0] in ('L', 'N')]
+    if len(meaningful) < MIN_MEANINGFUL_CHARS:
+        return True
+    if _REPEATED_CHAR_PATTERN.match(''.join(meaningful)):
+        return True
+    return len(meaningful) / len(text.replace(' ', '')) < MIN_MEANINGFUL_RATIO
+
+def canonical_key(text: str) -> str:
+    """
+    質問文の正規化キー
+    表記ゆれ（全角・半角、大文字・小文字、記号、文末表現）を吸収し、
+    キャッシュや完全一致テーブルの検索キーとして使用する
+
+    Args:
+        text: 質問文（音声認識結果）
+
+    Returns:
+        正規化キー
+    """
+    key = normalize_transcript(text).lower()
+    key = _PUNCTUATION_PATTERN.sub('', key)
+
+    # 文末表現を繰り返し除去（例: 「入らないんですけどね」→「入らない」）
+    stripped = True
+    while stripped and key:
+        stripped = False
+        for expression in _TRAILING_EXPRESSIONS:
+            if key.endswith(expression) and len(key) > len(expression):
+                key = key[:-len(expression)]
+                stripped = True
+                break
+
+    return key
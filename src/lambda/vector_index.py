@@ -0,0 +1,198 @@
+import hashlib
+import json
+import math
+import struct
+from typing import Dict, Any, List, Optional, Callable
+
+# NumPyはLambdaレイヤーで提供される想定（未提供の場合は純Python実装で検索する）
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 埋め込み行列アーティファクト
+# 注：qa-data/ はKnowledge Baseのデータソース対象のため、別プレフィックスに配置する
+VECTOR_INDEX_KEY = 'knowledge-artifacts/qa-embeddings.bin'
+
+# アーティファクト形式: MAGIC + ヘッダ長(uint32 LE) + JSONヘッダ + 行優先の行列（リトルエンディアン）
+INDEX_MAGIC = b'QAVI'
+SUPPORTED_DTYPES = {'float16': ('e', 2), 'float32': ('f', 4)}
+
+def embedding_text(qa: Dict[str, Any]) -> str:
+    """Q&Aエントリから埋め込み対象のテキストを作成"""
+    keywords = ' '.join(qa.get('keywords', []))
+    return f"{qa['question']} {keywords}".strip()
+
+def content_hash(text: str) -> str:
+    """埋め込み対象テキストのハッシュ（再計算要否の判定用）"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def normalize(vector: List[float]) -> List[float]:
+    """L2正規化"""
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        return list(vector)
+    return [v / norm for v in vector]
+
+def embed_with_bedrock(client, model_id: str, text: str, dimensions: int) -> List[float]:
+    """
+    Bedrockの埋め込みモデル（Titan Text Embeddings）でテキストを埋め込む
+
+    Args:
+        client: Bedrock Runtimeクライアント
+        model_id: 埋め込みモデルID
+        text: 埋め込むテキスト
+        dimensions: 埋め込みの次元数
+
+    Returns:
+        埋め込みベクトル
+    """
+    response = client.invoke_model(
+        modelId=model_id,
+        body=json.dumps({
+            'inputText': text,
+            'dimensions': dimensions,
+            'normalize': True
+        })
+    )
+    return json.loads(response['body'].read())['embedding']
+
+def hashed_ngram_embedding(text: str, dimensions: int) -> List[float]:
+    """
+    文字バイグラムのハッシュによる簡易埋め込み
+    Bedrockを使用しないローカル実行・検証用の代替
+    """
+    vector = [0.0] * dimensions
+    text = text.lower()
+    for i in range(max(len(text) - 1, 1)):
+        gram = text[i:i + 2]
+        digest = hashlib.md5(gram.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    return normalize(vector)
+
+class VectorIndex:
+    """
+    Q&A埋め込み行列に対するインプロセスのコサイン類似度検索
+    行は保存時にL2正規化済みのため、内積がコサイン類似度となる
+    """
+    def __init__(self, ids: List[str], hashes: List[str], dimensions: int, dtype: str, matrix_bytes: bytes):
+        self.ids = ids
+        self.hashes = hashes
+        self.dimensions = dimensions
+        self.dtype = dtype
+        self.matrix_bytes = matrix_bytes
+
+        if np is not None:
+            self.matrix = np.frombuffer(matrix_bytes, dtype=np.dtype(dtype).newbyteorder('<'))
+            self.matrix = self.matrix.reshape(len(ids), dimensions).astype(np.float32)
+        else:
+            self.matrix = self._unpack_rows(matrix_bytes)
+
+    def _unpack_rows(self, matrix_bytes: bytes) -> List[List[float]]:
+        code, _ = SUPPORTED_DTYPES[self.dtype]
+        values = struct.unpack(f'<{len(self.ids) * self.dimensions}{code}', matrix_bytes)
+        return [
+            list(values[i * self.dimensions:(i + 1) * self.dimensions])
+            for i in range(len(self.ids))
+        ]
+
+    @classmethod
+    def build(cls, qa_data: List[Dict[str, Any]], embed: Callable[[str], List[float]],
+              dtype: str = 'float16', previous: Optional['VectorIndex'] = None) -> 'VectorIndex':
+        """
+        Q&Aデータから埋め込み行列を構築
+        前回のインデックスで内容が変わっていないエントリは埋め込みを再利用する
+
+        Args:
+            qa_data: Q&Aデータ
+            embed: テキストを埋め込みベクトルに変換する関数
+            dtype: 保存時の数値型（float16 / float32）
+            previous: 前回のインデックス
+
+        Returns:
+            構築したインデックス
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+
+        reusable = previous.vectors_by_hash() if previous is not None else {}
+
+        ids, hashes, rows = [], [], []
+        for qa in qa_data:
+            text = embedding_text(qa)
+            text_hash = content_hash(text)
+            vector = reusable.get(text_hash)
+            if vector is None:
+                vector = normalize(embed(text))
+            ids.append(qa['id'])
+            hashes.append(text_hash)
+            rows.append(vector)
+
+        dimensions = len(rows[0]) if rows else 0
+        code, _ = SUPPORTED_DTYPES[dtype]
+        values = [v for row in rows for v in row]
+        matrix_bytes = struct.pack(f'<{len(values)}{code}', *values)
+
+        return cls(ids, hashes, dimensions, dtype, matrix_bytes)
+
+    def vectors_by_hash(self) -> Dict[str, List[float]]:
+        """内容ハッシュごとの埋め込みベクトル"""
+        rows = self.matrix.tolist() if np is not None else self.matrix
+        return dict(zip(self.hashes, rows))
+
+    def to_bytes(self) -> bytes:
+        """アーティファクトとしてシリアライズ"""
+        header = json.dumps({
+            'ids': self.ids,
+            'hashes': self.hashes,
+            'dimensions': self.dimensions,
+            'dtype': self.dtype
+        }).encode('utf-8')
+        return INDEX_MAGIC + struct.pack('<I', len(header)) + header + self.matrix_bytes
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'VectorIndex':
+        """アーティファクトから読み込み"""
+        if data[:4] != INDEX_MAGIC:
+            raise ValueError("Invalid vector index artifact")
+        header_length = struct.unpack('<I', data[4:8])[0]
+        header = json.loads(data[8:8 + header_length].decode('utf-8'))
+        return cls(
+            header['ids'],
+            header['hashes'],
+            header['dimensions'],
+            header['dtype'],
+            data[8 + header_length:]
+        )
+
+    def search(self, query: List[float], k: int = 3) -> List[tuple[float, str]]:
+        """
+        コサイン類似度の上位k件を検索
+
+        Args:
+            query: クエリの埋め込みベクトル
+            k: 取得件数
+
+        Returns:
+            （類似度, Q&A ID）のリスト（降順）
+        """
+        if not self.ids:
+            return []
+
+        k = min(k, len(self.ids))
+
+        if np is not None:
+            q = np.asarray(query, dtype=np.float32)
+            norm = np.linalg.norm(q)
+            if norm > 0:
+                q = q / norm
+            scores = self.matrix @ q
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self.ids[i]) for i in top]
+
+        q = normalize(query)
+        scores = [sum(a * b for a, b in zip(row, q)) for row in self.matrix]
+        top = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+        return [(scores[i], self.ids[i]) for i in top]
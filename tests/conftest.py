@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Lambda関数のモジュールはsrc/lambda直下からインポートする（Lambdaの実行環境と同じ）
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'lambda'))
+
+# boto3クライアントの初期化に必要なリージョン（AWSへの接続は行わない）
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
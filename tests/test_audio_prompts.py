@@ -0,0 +1,149 @@
+import io
+import json
+import struct
+from datetime import datetime, timedelta
+
+from botocore.exceptions import ClientError
+
+from audio_prompts import (
+    AUDIO_MANIFEST_KEY, SAMPLE_RATE, AudioPromptCache, LocalSynthesizer, audio_hash,
+    encode_ulaw_wav, find_prompt, linear_to_ulaw
+)
+from ingestion_tracker import KNOWLEDGE_VERSION_KEY
+
+BUCKET = 'knowledge'
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.puts = []
+        self.deletes = []
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body.encode('utf-8') if isinstance(Body, str) else Body
+        self.puts.append(Key)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop(Key, None)
+        self.deletes.append(Key)
+
+    def manifest(self):
+        return json.loads(self.objects[AUDIO_MANIFEST_KEY])
+
+    def publish(self, published_at: datetime):
+        self.objects[KNOWLEDGE_VERSION_KEY] = json.dumps({'publishedAt': published_at.isoformat()}).encode('utf-8')
+
+class CountingSynthesizer(LocalSynthesizer):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def synthesize(self, text):
+        self.texts.append(text)
+        return super().synthesize(text)
+
+class FakeNow:
+    def __init__(self):
+        self.value = datetime(2025, 6, 1, 9, 0, 0)
+
+    def __call__(self):
+        return self.value
+
+QA = [
+    {'id': 'qa-1', 'answer': 'レシート用紙を交換してください。'},
+    {'id': 'qa-2', 'answer': '釣り銭機の扉を開けて詰まりを取り除いてください。'}
+]
+
+def make_cache(s3, now=None):
+    return AudioPromptCache(s3, BUCKET, CountingSynthesizer(), now=now or FakeNow())
+
+def test_encode_ulaw_wav_writes_connect_prompt_header():
+    pcm = struct.pack('<4h', 0, 1000, -1000, 32767)
+    wav = encode_ulaw_wav(pcm)
+
+    assert wav[:4] == b'RIFF' and wav[8:12] == b'WAVE'
+    assert struct.unpack('<I', wav[4:8])[0] == len(wav) - 8
+    audio_format, channels, sample_rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', wav[20:36])
+    assert (audio_format, channels, sample_rate, byte_rate, block_align, bits) == (7, 1, SAMPLE_RATE, SAMPLE_RATE, 1, 8)
+    assert wav[-12:-8] == b'data'
+    assert struct.unpack('<I', wav[-8:-4])[0] == 4
+    assert wav[-4:] == bytes(linear_to_ulaw(s) for s in (0, 1000, -1000, 32767))
+
+def test_encode_ulaw_wav_is_one_byte_per_sample():
+    synthesizer = LocalSynthesizer(seconds_per_char=0.1)
+    pcm = synthesizer.synthesize('あいう')
+    wav = encode_ulaw_wav(pcm)
+    assert len(pcm) == 2 * 2400
+    assert len(wav) == 58 + 2400
+    # 無音はμ-lawの0xFF
+    assert set(wav[58:]) == {0xFF}
+
+def test_prerender_skips_unchanged_answers_and_rerenders_changed_ones():
+    s3 = FakeS3()
+    cache = make_cache(s3)
+    cache.prerender(QA, ['qa-1', 'qa-2'])
+    assert len(cache.synthesizer.texts) == 2
+
+    cache.prerender(QA, ['qa-1', 'qa-2'])
+    assert len(cache.synthesizer.texts) == 2
+
+    updated = [QA[0], dict(QA[1], answer='釣り銭機を再起動してください。')]
+    manifest = cache.prerender(updated, ['qa-1', 'qa-2'])
+    assert cache.synthesizer.texts[2:] == ['釣り銭機を再起動してください。']
+    assert manifest['prompts']['qa-2']['hash'] == audio_hash(updated[1]['answer'], 'local', 'local')
+    assert s3.manifest() == manifest
+
+def test_stale_audio_is_kept_until_a_version_is_published():
+    s3 = FakeS3()
+    now = FakeNow()
+    cache = make_cache(s3, now)
+    old_key = cache.prerender(QA, ['qa-1', 'qa-2'])['prompts']['qa-2']['key']
+
+    now.value += timedelta(hours=1)
+    manifest = cache.prerender(QA, ['qa-1'])
+    # 古いマニフェストを保持するプロセッサが参照するため、すぐには削除しない
+    assert old_key in s3.objects
+    assert list(manifest['retired']) == [old_key]
+
+    # 公開前（Ingestion失敗など）の再実行でも削除しない
+    now.value += timedelta(hours=1)
+    cache.prerender(QA, ['qa-1'])
+    assert s3.deletes == []
+
+    s3.publish(now.value + timedelta(minutes=1))
+    now.value += timedelta(minutes=2)
+    cache.prerender(QA, ['qa-1'])
+    # 公開直後はマーカーの確認間隔の猶予内のため削除しない
+    assert s3.deletes == []
+
+    now.value += timedelta(hours=1)
+    manifest = cache.prerender(QA, ['qa-1'])
+    assert s3.deletes == [old_key]
+    assert old_key not in s3.objects
+    assert manifest['retired'] == {}
+
+def test_reselected_audio_is_no_longer_retired():
+    s3 = FakeS3()
+    now = FakeNow()
+    cache = make_cache(s3, now)
+    cache.prerender(QA, ['qa-1', 'qa-2'])
+    cache.prerender(QA, ['qa-1'])
+
+    s3.publish(now.value + timedelta(minutes=1))
+    now.value += timedelta(hours=1)
+    manifest = cache.prerender(QA, ['qa-1', 'qa-2'])
+    assert manifest['retired'] == {}
+    assert s3.deletes == []
+
+def test_find_prompt_rejects_changed_answer_text():
+    s3 = FakeS3()
+    manifest = make_cache(s3).prerender(QA, ['qa-1'])
+
+    assert find_prompt(manifest, 'qa-1', QA[0]['answer']) == manifest['prompts']['qa-1']['key']
+    assert find_prompt(manifest, 'qa-1', 'ロール紙を交換してください。') is None
+    assert find_prompt(manifest, 'qa-2', QA[1]['answer']) is None
@@ -0,0 +1,173 @@
+import hashlib
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from botocore.exceptions import ClientError
+
+from backup_manager import BACKUP_MANIFEST_KEY, BackupManager
+
+BUCKET = 'knowledge'
+SOURCE_KEY = 'qa-data/qa-knowledge.json'
+
+class FakeS3:
+    """ETagと条件付きコピーを再現するS3クライアントの代替"""
+    def __init__(self):
+        self.objects = {}
+        self.copies = []
+        self.deletes = []
+
+    def _etag(self, key):
+        return f'"{hashlib.md5(self.objects[key]).hexdigest()}"'
+
+    def _require(self, key, operation):
+        if key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': key}}, operation)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._require(Key, 'HeadObject')
+        return {'ETag': self._etag(Key), 'ContentLength': len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, IfMatch=None, **kwargs):
+        self._require(Key, 'GetObject')
+        if IfMatch is not None and IfMatch != self._etag(Key):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': Key}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body.encode('utf-8') if isinstance(Body, str) else Body
+
+    def copy_object(self, CopySource, Bucket, Key, CopySourceIfMatch=None, **kwargs):
+        source = CopySource['Key']
+        self._require(source, 'CopyObject')
+        if CopySourceIfMatch is not None and CopySourceIfMatch != self._etag(source):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': source}}, 'CopyObject')
+        self.objects[Key] = self.objects[source]
+        self.copies.append((source, Key))
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop(Key, None)
+        self.deletes.append(Key)
+
+    def write_source(self, qa_data):
+        self.objects[SOURCE_KEY] = json.dumps(qa_data, ensure_ascii=False).encode('utf-8')
+
+    def manifest(self):
+        return json.loads(self.objects[BACKUP_MANIFEST_KEY])
+
+    def age_versions(self, days, versions):
+        """指定バージョンの作成日時をdays日前にする"""
+        manifest = self.manifest()
+        created_at = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        for entry in manifest['versions']:
+            if entry['version'] in versions:
+                entry['createdAt'] = created_at
+        self.objects[BACKUP_MANIFEST_KEY] = json.dumps(manifest).encode('utf-8')
+
+A = [{'id': 'qa-1', 'answer': 'レシート用紙を交換してください。'}]
+B = [{'id': 'qa-1', 'answer': 'ロール紙を交換してください。'}]
+C = [{'id': 'qa-1', 'answer': 'プリンターの蓋を閉めてください。'}]
+
+def make_manager(s3, **kwargs):
+    return BackupManager(s3, BUCKET, source_key=SOURCE_KEY, **kwargs)
+
+def backup(s3, manager, qa_data):
+    s3.write_source(qa_data)
+    return manager.backup()
+
+def test_backup_is_skipped_when_etag_is_unchanged():
+    s3 = FakeS3()
+    manager = make_manager(s3)
+    first = backup(s3, manager, A)
+    assert first['status'] == 'created' and first['version'] == 1
+
+    second = manager.backup()
+    assert second == {'status': 'unchanged', 'version': 1, 'hash': first['hash']}
+    assert len(s3.copies) == 1
+    assert len(s3.manifest()['versions']) == 1
+
+def test_returning_to_previous_content_reuses_stored_object():
+    s3 = FakeS3()
+    manager = make_manager(s3)
+    v1 = backup(s3, manager, A)
+    backup(s3, manager, B)
+    v3 = backup(s3, manager, A)
+
+    assert v3['version'] == 3
+    assert v3['hash'] == v1['hash']
+    # 以前と同じ内容はコピーせず、既存オブジェクトを参照する
+    assert len(s3.copies) == 2
+    versions = s3.manifest()['versions']
+    assert versions[0]['key'] == versions[2]['key']
+
+def test_count_pruning_keeps_objects_still_referenced():
+    s3 = FakeS3()
+    manager = make_manager(s3, retention_count=2)
+    a = backup(s3, manager, A)
+    b = backup(s3, manager, B)
+    # v1は除外されるが、同じ内容のv3が残るためAのオブジェクトは削除しない
+    assert backup(s3, manager, A)['pruned'] == [1]
+    assert s3.deletes == []
+
+    assert backup(s3, manager, C)['pruned'] == [2]
+    assert [v['version'] for v in s3.manifest()['versions']] == [3, 4]
+    assert s3.deletes == [manager.object_key(b['hash'])]
+    assert manager.object_key(a['hash']) in s3.objects
+
+def test_age_pruning_keeps_objects_still_referenced():
+    s3 = FakeS3()
+    manager = make_manager(s3, retention_days=90)
+    a = backup(s3, manager, A)
+    b = backup(s3, manager, B)
+    backup(s3, manager, A)
+    s3.age_versions(100, {1, 2})
+
+    result = backup(s3, manager, C)
+    assert result['pruned'] == [1, 2]
+    assert s3.deletes == [manager.object_key(b['hash'])]
+    assert manager.object_key(a['hash']) in s3.objects
+
+def test_latest_version_is_kept_regardless_of_age():
+    s3 = FakeS3()
+    manager = make_manager(s3, retention_days=90)
+    a = backup(s3, manager, A)
+    s3.age_versions(100, {1})
+
+    assert manager.prune(s3.manifest()) == []
+    assert manager.object_key(a['hash']) in s3.objects
+
+def test_restore_by_version_number():
+    s3 = FakeS3()
+    manager = make_manager(s3)
+    backup(s3, manager, A)
+    backup(s3, manager, B)
+
+    result = manager.restore(1)
+    assert result['version'] == 1
+    assert json.loads(s3.objects[SOURCE_KEY]) == A
+
+    # イベントのパラメータなど文字列で指定された番号も受け付ける
+    assert manager.restore('2')['version'] == 2
+    assert json.loads(s3.objects[SOURCE_KEY]) == B
+
+def test_restore_by_hash_prefix():
+    s3 = FakeS3()
+    manager = make_manager(s3)
+    a = backup(s3, manager, A)
+    backup(s3, manager, B)
+
+    result = manager.restore(a['hash'][:8])
+    assert result == {'status': 'restored', 'version': 1, 'hash': a['hash']}
+    assert json.loads(s3.objects[SOURCE_KEY]) == A
+
+def test_restore_rejects_unknown_or_short_hash():
+    s3 = FakeS3()
+    manager = make_manager(s3)
+    a = backup(s3, manager, A)
+
+    with pytest.raises(ValueError):
+        manager.restore(a['hash'][:7])
+    with pytest.raises(ValueError):
+        manager.restore(5)
+    assert len(s3.copies) == 1
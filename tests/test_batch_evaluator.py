@@ -0,0 +1,22 @@
+import pytest
+
+from batch_evaluator import percentile
+
+@pytest.mark.parametrize('values, p, expected', [
+    (list(range(1, 11)), 90, 9),
+    (list(range(1, 101)), 99, 99),
+    (list(range(1, 101)), 7, 7),
+    ([1, 2], 50, 1),
+    ([1, 2, 3], 50, 2),
+    (list(range(1, 21)), 95, 19),
+    (list(range(1, 11)), 100, 10),
+    (list(range(1, 11)), 0, 1),
+])
+def test_percentile_uses_nearest_rank(values, p, expected):
+    assert percentile(values, p) == expected
+
+def test_percentile_ignores_input_order():
+    assert percentile([5.0, 1.0, 4.0, 2.0, 3.0], 50) == 3.0
+
+def test_percentile_of_no_values_is_none():
+    assert percentile([], 50) is None
@@ -0,0 +1,49 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import concurrency_autoscaler
+from concurrency_autoscaler import LEVEL_MAX, hourly_peak_concurrency, load_fixture, plan
+
+# 2025-06-02（月）に作成した関数の記録（毎日08:00〜11:00 UTCに300件/5分、応答時間3秒）
+# 2025-06-05は08時台のみ通常の5倍の呼び出し
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'autoscaler_metrics.json')
+
+@pytest.fixture
+def history():
+    return load_fixture(FIXTURE_PATH)
+
+def test_hours_before_first_datapoint_are_absent(history):
+    hourly = hourly_peak_concurrency(history)
+    assert min(hourly) == datetime(2025, 6, 2, 8)
+    assert hourly[datetime(2025, 6, 2, 9)] == pytest.approx(3.0)
+    assert hourly[datetime(2025, 6, 3, 2)] == 0.0
+
+def test_new_function_uses_same_hour_of_previous_days(history):
+    decision = plan(history, datetime(2025, 6, 4, 8, 50))
+    assert decision['targetHour'] == '2025-06-04T09:00:00'
+    assert decision['seasonal'] == pytest.approx(3.0)
+    assert decision['level'] == pytest.approx(1.0)
+    assert decision['target'] == 4
+
+def test_idle_hours_release_provisioned_concurrency(history):
+    decision = plan(history, datetime(2025, 6, 4, 2, 50))
+    assert decision['forecast'] == 0.0
+    assert decision['target'] == 0
+
+def test_level_is_clamped(history):
+    decision = plan(history, datetime(2025, 6, 5, 8, 50))
+    assert decision['level'] == LEVEL_MAX
+    assert decision['forecast'] == pytest.approx(3.0 * LEVEL_MAX)
+    assert decision['target'] == 8
+
+def test_no_history_uses_maximum(history):
+    decision = plan(history, datetime(2025, 6, 1, 8, 50))
+    assert decision['forecast'] is None
+    assert decision['target'] == concurrency_autoscaler.PROVISIONED_MAX
+
+def test_dry_run_from_fixture(capsys):
+    assert concurrency_autoscaler.main(['--fixture', FIXTURE_PATH, '--at', '2025-06-04T08:50:00']) == 0
+    assert json.loads(capsys.readouterr().out)['target'] == 4
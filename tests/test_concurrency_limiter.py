@@ -0,0 +1,141 @@
+import random
+import threading
+
+from concurrency_limiter import AdaptiveConcurrencyLimiter, FleetConcurrencyLimit
+from single_flight import InMemoryLeaseStore
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+def fleet_limiter(store: InMemoryLeaseStore, clock: FakeClock, slots: int = 2) -> AdaptiveConcurrencyLimiter:
+    """コンテナごとに1つ作られる制限（共有ストアのみ共通）"""
+    fleet = FleetConcurrencyLimit(store, slots, sleep=clock.sleep, clock=clock)
+    return AdaptiveConcurrencyLimiter(clock=clock, fleet=fleet)
+
+def test_success_increases_limit_additively():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4.0, clock=FakeClock())
+    limiter.on_success(2.0)
+    assert limiter.limit == 4.25
+
+def test_throttle_halves_limit_down_to_minimum():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4.0, min_limit=0.1, clock=FakeClock())
+    for expected in (2.0, 1.0, 0.5, 0.25, 0.125, 0.1, 0.1):
+        limiter.on_throttle()
+        assert limiter.limit == expected
+    assert limiter.drain_counters()['throttled'] == 7
+
+def test_latency_variation_alone_never_sheds():
+    rng = random.Random(0)
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4.0, clock=FakeClock())
+    shed = 0
+    for _ in range(2000):
+        if not limiter.acquire(deadline=2000.0):
+            shed += 1
+            continue
+        limiter.on_success(rng.uniform(1.0, 5.0))
+        limiter.release()
+        assert limiter.limit >= 1.0
+    assert shed == 0
+
+def test_latency_spike_backs_off_but_not_below_one():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1.5, clock=FakeClock())
+    limiter.on_success(1.0)
+    for _ in range(10):
+        limiter.on_success(30.0)
+    assert limiter.limit == 1.0
+
+def test_fractional_admission_uses_limit_as_probability():
+    draws = iter([0.3, 0.7])
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1.0, clock=FakeClock(), rand=lambda: next(draws))
+    limiter.on_throttle()
+    assert limiter.acquire(deadline=2000.0) is True
+    limiter.release()
+    assert limiter.acquire(deadline=2000.0) is False
+    counters = limiter.drain_counters()
+    assert counters['limit'] == 0.5
+    assert counters['attempts'] == 1
+    assert counters['shed'] == 1
+
+def test_limit_recovers_after_quiet_interval():
+    clock = FakeClock()
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1.0, recovery_interval=10.0, clock=clock, rand=lambda: 0.99)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.limit == 0.25
+
+    clock.now += 5.0
+    assert limiter.acquire(deadline=clock.now + 30.0) is False
+    assert limiter.limit == 0.25
+
+    clock.now += 10.0
+    limiter.acquire(deadline=clock.now + 30.0)
+    assert limiter.limit == 0.5
+
+def test_sheds_when_no_time_left_before_deadline():
+    clock = FakeClock()
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1.0, clock=clock)
+    assert limiter.acquire(deadline=clock.now + 10.0) is True
+    assert limiter.acquire(deadline=clock.now - 1.0) is False
+    assert limiter.drain_counters()['shed'] == 1
+
+def test_without_deadline_waits_for_free_slot():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1.0)
+    assert limiter.acquire() is True
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+    waiter.start()
+    waiter.join(timeout=0.2)
+    assert waiter.is_alive()
+
+    limiter.release()
+    waiter.join(timeout=2.0)
+    assert results == [True]
+    assert limiter.drain_counters()['shed'] == 0
+
+def test_cold_container_starts_at_one_and_throttle_drops_below_one():
+    limiter = AdaptiveConcurrencyLimiter(clock=FakeClock(), rand=lambda: 0.99)
+    assert limiter.limit == 1.0
+    limiter.on_throttle()
+    assert limiter.acquire(deadline=2000.0) is False
+
+def test_fleet_limit_bounds_concurrency_across_containers():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    containers = [fleet_limiter(store, clock) for _ in range(3)]
+
+    assert containers[0].acquire(deadline=clock.now + 10.0) is True
+    assert containers[1].acquire(deadline=clock.now + 10.0) is True
+    # 新しいコンテナでも、フリート全体の枠が埋まっていれば期限まで待って負荷制限する
+    start = clock.now
+    assert containers[2].acquire(deadline=clock.now + 10.0) is False
+    assert clock.now > start
+    assert containers[2].drain_counters()['shed'] == 1
+    assert containers[2].inflight == 0
+
+def test_fleet_slot_is_reusable_after_release():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    first, second = fleet_limiter(store, clock, slots=1), fleet_limiter(store, clock, slots=1)
+
+    assert first.acquire(deadline=clock.now + 10.0) is True
+    first.release()
+    assert second.acquire(deadline=clock.now + 10.0) is True
+    assert first.acquire(deadline=clock.now - 1.0) is False
+
+def test_fleet_slot_of_crashed_container_expires():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    crashed, other = fleet_limiter(store, clock, slots=1), fleet_limiter(store, clock, slots=1)
+
+    assert crashed.acquire(deadline=clock.now + 10.0) is True
+    # 枠を解放しないまま終了したコンテナの枠はリースの期限切れで再利用できる
+    clock.now += 31.0
+    assert other.acquire(deadline=clock.now + 10.0) is True
@@ -0,0 +1,55 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import batch_evaluator
+import helpdesk_processor
+import structured_logger
+
+@pytest.fixture
+def keyword_only(monkeypatch):
+    """Knowledge Base・埋め込み行列・完全一致テーブルのない構成（S3のQ&Aデータのみ）"""
+    with open(batch_evaluator.DEFAULT_QA_DATA_PATH, 'rb') as f:
+        qa_body = f.read()
+    monkeypatch.setattr(helpdesk_processor, 's3', batch_evaluator.LocalS3Client({'qa-data/qa-knowledge.json': qa_body}))
+    monkeypatch.setattr(helpdesk_processor, 'bedrock_runtime', batch_evaluator.LocalBedrockRuntime())
+    monkeypatch.setattr(helpdesk_processor, 'KNOWLEDGE_BASE_ID', None)
+    monkeypatch.setattr(helpdesk_processor, 'KNOWLEDGE_BUCKET', 'local')
+    for key in helpdesk_processor._knowledge_cache:
+        monkeypatch.setitem(helpdesk_processor._knowledge_cache, key, None)
+    monkeypatch.setitem(helpdesk_processor._knowledge_cache, 'checked_at', 0.0)
+
+@pytest.mark.parametrize('question, category', [
+    ('レシートが印刷されない', 'プリンタートラブル'),
+    ('釣り銭機のエラーで硬貨が詰まりました', '釣り銭機トラブル'),
+])
+def test_keyword_match_is_answered_without_generation(keyword_only, question, category):
+    trace = {}
+    answer, confidence, answered_category = helpdesk_processor.process_question(question, trace)
+
+    assert answered_category == category
+    assert confidence >= helpdesk_processor.GENERATION_CONFIDENCE_THRESHOLD
+    assert trace['features']['lexical_score'] == 1.0
+    assert trace['features']['agreement'] == 1.0
+
+def test_weak_keyword_match_falls_back_to_generation(keyword_only):
+    _, _, category = helpdesk_processor.process_question('なんかエラーが出てるんですが', {})
+    assert category == 'bedrock_generated'
+
+class FailingAgentRuntime:
+    def retrieve(self, **kwargs):
+        raise ClientError({'Error': {'Code': 'ResourceNotFoundException', 'Message': 'no such KB'}}, 'Retrieve')
+
+def test_fallback_errors_do_not_escalate_the_invocation_log(keyword_only, monkeypatch):
+    monkeypatch.setattr(helpdesk_processor, 'bedrock_agent_runtime', FailingAgentRuntime())
+    monkeypatch.setattr(helpdesk_processor, 'KNOWLEDGE_BASE_ID', 'production-placeholder')
+    log = structured_logger.InvocationLog('test', sample_rate=0.0)
+    token = structured_logger._current.set(log)
+    try:
+        _, _, category = helpdesk_processor.process_question('レシートが印刷されない', {})
+    finally:
+        structured_logger._current.reset(token)
+
+    assert category == 'プリンタートラブル'
+    assert [e['context'] for e in log.errors] == ['knowledge_base_search']
+    assert not log.escalated
+    assert 'stack' not in log._format_error(log.errors[0])
@@ -0,0 +1,21 @@
+import pytest
+
+from error_handler import ErrorType, HelpdeskError, validate_input
+from text_normalizer import normalize_transcript
+
+def _event(text: str):
+    return {'Details': {'Parameters': {'transcribedText': text}}}
+
+@pytest.mark.parametrize('text', ['えーと', 'えーとえーと', 'えーと、えーと', 'まあ、えっとうーん', 'あのあのー'])
+def test_filler_only_input_is_no_input(text):
+    with pytest.raises(HelpdeskError) as e:
+        validate_input(_event(text))
+    assert e.value.error_type == ErrorType.NO_INPUT
+
+@pytest.mark.parametrize('text, expected', [
+    ('えーと、パスワードを忘れました', 'パスワードを忘れました'),
+    ('えーと えーと レシートが出ません', 'レシートが出ません'),
+    ('あのパソコンが起動しません', 'あのパソコンが起動しません'),
+])
+def test_fillers_are_removed_from_questions(text, expected):
+    assert normalize_transcript(text) == expected
@@ -0,0 +1,42 @@
+from prompt_templates import PromptLibrary, build_request_body, estimate_tokens, prompt_cache_min_tokens
+
+SONNET_4 = 'us.anthropic.claude-sonnet-4-20250514-v1:0'
+
+def _qa(category: str, count: int, length: int = 200):
+    return [
+        {'category': category, 'question': f'{category}の質問{i}', 'answer': 'あ' * length}
+        for i in range(count)
+    ]
+
+def _is_cached(model_id: str, system_prompt: str) -> bool:
+    return 'cache_control' in build_request_body(model_id, system_prompt, '質問')['system'][0]
+
+def test_cache_min_tokens_per_model():
+    assert prompt_cache_min_tokens(SONNET_4) == 1024
+    assert prompt_cache_min_tokens('anthropic.claude-3-5-haiku-20241022-v1:0') == 2048
+    assert prompt_cache_min_tokens('claude-3-5-sonnet-20241022') is None
+
+def test_short_system_prompt_is_not_marked_for_cache():
+    library = PromptLibrary(_qa('電源', 1))
+    assert not _is_cached(SONNET_4, library.system_prompt('電源'))
+
+def test_category_prompt_is_filled_to_cache_minimum():
+    library = PromptLibrary(_qa('電源', 1) + _qa('印刷', 10), token_budget=600, min_tokens=1024)
+    prompt = library.system_prompt('電源')
+
+    assert estimate_tokens(prompt) >= 1024
+    assert prompt.index('電源の質問0') < prompt.index('印刷の質問')
+    assert _is_cached(SONNET_4, prompt)
+
+def test_prompt_without_min_tokens_keeps_budget():
+    library = PromptLibrary(_qa('電源', 1) + _qa('印刷', 10), token_budget=600)
+    assert '印刷' not in library.system_prompt('電源')
+
+def test_prompt_is_not_padded_when_minimum_is_unreachable():
+    library = PromptLibrary(_qa('電源', 1) + _qa('印刷', 2), token_budget=0, min_tokens=2048)
+    assert library.system_prompt('電源') == library.system_prompt(None)
+    assert '印刷' not in library.system_prompt('電源')
+
+def test_examples_are_off_by_default():
+    library = PromptLibrary(_qa('電源', 3))
+    assert '電源の質問' not in library.system_prompt('電源')
@@ -0,0 +1,33 @@
+import pytest
+
+from reranker import Calibrator, extract_features, reciprocal_rank_fusion
+
+def _confidence(rankings, scores):
+    fused = reciprocal_rank_fusion(rankings)
+    features = extract_features(fused[0][1], fused, rankings, scores)
+    return features, Calibrator().probability(features)
+
+def test_lone_weak_candidate_is_not_confident():
+    rankings = {'kb': [], 'vector': [], 'lexical': ['qa-004']}
+    features, confidence = _confidence(rankings, {'lexical': {'qa-004': 0.33}})
+    assert features['agreement'] == pytest.approx(1 / 3)
+    assert features['rrf'] == pytest.approx(1 / 3)
+    assert confidence < 0.5
+
+def test_agreeing_sources_are_confident():
+    rankings = {'vector': ['qa-001', 'qa-002'], 'lexical': ['qa-001']}
+    scores = {'vector': {'qa-001': 0.8, 'qa-002': 0.4}, 'lexical': {'qa-001': 1.0}}
+    features, confidence = _confidence(rankings, scores)
+    assert features['agreement'] == 1.0
+    assert confidence > 0.5
+
+def test_lexical_only_match_clears_threshold():
+    # Knowledge Base・埋め込み行列のない構成ではキーワードマッチングのみを検索したソースとする
+    strong, strong_confidence = _confidence({'lexical': ['qa-003', 'qa-007']}, {'lexical': {'qa-003': 1.0, 'qa-007': 0.33}})
+    _, two_keywords_confidence = _confidence({'lexical': ['qa-001', 'qa-002']}, {'lexical': {'qa-001': 0.67, 'qa-002': 0.67}})
+    _, one_keyword_confidence = _confidence({'lexical': ['qa-004']}, {'lexical': {'qa-004': 0.33}})
+
+    assert strong['rrf'] == 1.0 and strong['agreement'] == 1.0
+    assert strong_confidence > 0.5
+    assert two_keywords_confidence > 0.5
+    assert one_keyword_confidence < 0.5
@@ -0,0 +1,126 @@
+import threading
+
+import pytest
+
+from single_flight import SingleFlight, InMemoryLeaseStore
+
+class FakeClock:
+    """sleepで進む時計"""
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps = 0
+        self.on_sleep = None
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps += 1
+        self.now += seconds
+        if self.on_sleep:
+            self.on_sleep()
+
+def _flight(store, clock, **kwargs) -> SingleFlight:
+    return SingleFlight(store, sleep=clock.sleep, clock=clock, **kwargs)
+
+def test_concurrent_calls_in_container_run_once():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=2.0)
+        return {'answer': 'x'}
+
+    flight = SingleFlight()
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', fn)))
+    leader.start()
+    started.wait(timeout=2.0)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', fn))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(timeout=2.0)
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == {'answer': 'x'} for result, _ in results)
+
+def test_in_container_follower_stops_waiting_at_timeout():
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(timeout=2.0)
+        return {'answer': 'leader'}
+
+    flight = SingleFlight(wait_timeout=0.05)
+    leader = threading.Thread(target=lambda: flight.do('k', slow))
+    leader.start()
+    started.wait(timeout=2.0)
+
+    assert flight.do('k', lambda: {'answer': 'local'}) == ({'answer': 'local'}, False)
+    release.set()
+    leader.join(timeout=2.0)
+
+def test_published_result_is_shared_across_containers():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    first, second = _flight(store, clock), _flight(store, clock)
+
+    assert first.do('k', lambda: {'answer': 'x'}) == ({'answer': 'x'}, False)
+    assert second.do('k', lambda: pytest.fail('should not run')) == ({'answer': 'x'}, True)
+
+def test_unpublished_result_is_not_shared():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    first, second = _flight(store, clock), _flight(store, clock)
+
+    first.do('k', lambda: {'category': 'shed'}, publish_if=lambda r: r['category'] != 'shed')
+    assert second.do('k', lambda: {'category': 'ok'}) == ({'category': 'ok'}, False)
+    assert clock.sleeps == 0
+
+def test_follower_takes_over_when_leader_releases_without_publishing():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    store.acquire('k', 'other-container', ttl=10.0)
+    clock.on_sleep = lambda: store.release('k', 'other-container')
+
+    flight = _flight(store, clock, wait_timeout=5.0, poll_interval=0.2)
+    assert flight.do('k', lambda: {'answer': 'own'}) == ({'answer': 'own'}, False)
+    assert clock.sleeps == 1
+    assert store.get_entry('k') == {'status': 'done', 'result': {'answer': 'own'}}
+
+def test_follower_waits_for_pending_leader_until_timeout():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    store.acquire('k', 'other-container', ttl=60.0)
+
+    flight = _flight(store, clock, wait_timeout=1.0, poll_interval=0.25)
+    assert flight.do('k', lambda: {'answer': 'own'}) == ({'answer': 'own'}, False)
+    assert clock.sleeps == 4
+
+def test_follower_wait_is_bounded_by_deadline():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    store.acquire('k', 'other-container', ttl=60.0)
+
+    flight = _flight(store, clock, wait_timeout=5.0, poll_interval=0.25)
+    flight.do('k', lambda: {'answer': 'own'}, deadline=clock.now + 0.5)
+    assert clock.sleeps == 2
+
+def test_leader_failure_releases_lease():
+    clock = FakeClock()
+    store = InMemoryLeaseStore(clock=clock)
+    flight = _flight(store, clock)
+
+    def fail():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        flight.do('k', fail)
+    assert store.get_entry('k') is None